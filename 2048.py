@@ -2,7 +2,8 @@
 Clone of 2048 game.
 """
 
-import poc_2048_gui
+import collections
+import merge as merge_cache
 import random
 import simpletest
 
@@ -23,22 +24,10 @@ OFFSETS = {UP: (1, 0),
            RIGHT: (0, -1)}
 
 
-# Helper function for merge:
-def slide_list(line):
-    '''
-    Slides all of the non-zero tiles over to the 
-    beginning of the list with 
-    the appropriate number of zeroes at 
-    the end of the list
-    '''
-    slided = []
-    for num in line:
-        if num != 0:
-            slided.append(num)
-    if len(slided) != len(line):
-        for dummy_i in range(len(line) - len(slided)):
-            slided.append(0)
-    return slided
+# Result of a single move: whether any tile moved, the points
+# gained by merges and the indices of the lines that changed:
+MoveResult = collections.namedtuple("MoveResult",
+                                    ["moved", "score", "lines_touched"])
 
 
 def merge(line):
@@ -46,27 +35,7 @@ def merge(line):
     Function that merges a single 
     row or column in 2048.
     """
-    result = []
-    slided = slide_list(line)
-    index  = 0
-    while index <= len(slided) - 1:
-        if index == len(slided) - 1:
-            result.append(slided[index])
-            index += 1
-        elif slided[index] != slided[index + 1]:
-            if index == len(slided) - 2:
-                result.append(slided[index])
-                result.append(slided[index + 1])
-            else:
-                result.append(slided[index])
-            index += 1
-        else:
-            result += (([slided[index] * 2]) + [0])
-            index += 2
-    if len(result) > len(slided):
-        return slide_list(result[:-1])
-    else:
-        return slide_list(result)
+    return merge_cache.merge(line)
     
 
     
@@ -75,12 +44,20 @@ class TwentyFortyEight:
     """
     Class to run the game logic.
     """
-    def __init__(self, grid_height, grid_width):
+    def __init__(self, grid_height, grid_width, rng=None, undo_limit=0):
         self._grid_height = grid_height
         self._grid_width = grid_width
+        # Source of randomness for new tiles; pass a seeded
+        # random.Random to make a game reproducible
+        if rng is None:
+            rng = random
+        self._rng = rng
+        # Snapshots taken before each move, oldest dropped first
+        self._history = collections.deque(maxlen=undo_limit)
         self.reset()
         self.create_initials_cache()
         self.create_ranges_cache()
+        self.create_lines_cache()
         
     
     def create_initials_cache(self, testing=False):
@@ -114,6 +91,21 @@ class TwentyFortyEight:
             return self._loop_ranges
     
     
+    def create_lines_cache(self, testing=False):
+        '''
+        Cache the coordinates of every line in each direction,
+        so move does not have to regenerate them.
+        '''
+        self._lines = {}
+        for direction in OFFSETS:
+            self._lines[direction] = [
+                self.gen_offset_list(init_coord, OFFSETS[direction], 
+                                     self._loop_ranges[direction])
+                for init_coord in self._initials[direction]]
+        if testing:
+            return self._lines
+    
+    
     def reset(self):
         """
         Reset the game so the grid is 
@@ -124,6 +116,27 @@ class TwentyFortyEight:
         self._grid = [[0 for dummy_col in range(self._grid_width)] 
                                  for dummy_row in range(self._grid_height)]
         
+        # Index of empty cells: a list of coordinates plus a map
+        # from each coordinate to its position in the list, so
+        # cells can be added, removed and sampled in O(1)
+        self._empty_cells = [(row, col) for row in range(self._grid_height)
+                             for col in range(self._grid_width)]
+        self._empty_positions = dict((cell, index) for index, cell 
+                                     in enumerate(self._empty_cells))
+        
+        # Immutable copy of each row for snapshots, or None
+        # once the row has changed since the last snapshot
+        self._row_cache = [None] * self._grid_height
+        self._history.clear()
+        
+        # Lines that may change when moving in each direction.
+        # A line leaves the set once it is settled (compacted with
+        # no equal neighbours) and comes back when set_tile touches it
+        self._active_lines = {UP: set(range(self._grid_width)),
+                              DOWN: set(range(self._grid_width)),
+                              LEFT: set(range(self._grid_height)),
+                              RIGHT: set(range(self._grid_height))}
+        
         for dummy_i in range(2):
             self.new_tile()
         
@@ -169,38 +182,112 @@ class TwentyFortyEight:
         Moves all tiles in the given 
         direction and add a new tile 
         if any tiles moved.
+        Returns a MoveResult with the moved flag, the points
+        gained and the indices of the lines that changed.
         """
-        before_move = str(self._grid)
-        offset = OFFSETS[direction]
-        init_coords = self._initials[direction]
-      
-        for init_coord in init_coords:
-            offset_coords = self.gen_offset_list(init_coord, offset, self._loop_ranges[direction])
+        lines = self._lines[direction]
+        score = 0
+        lines_touched = []
+        if self._history.maxlen:
+            before_move = self.snapshot()
+        
+        # Settled lines cannot change, so only the active ones are
+        # merged; writing a line back marks it active again and it
+        # is dropped once its merged values are settled
+        active_lines = self._active_lines[direction]
+        self._active_lines[direction] = set()
+        for line_index in sorted(active_lines):
+            offset_coords = lines[line_index]
             temp_vals = [self._grid[offset_coord[0]][offset_coord[1]]
                         for offset_coord in offset_coords]
-            merged_vals = merge(temp_vals)
+            merged_vals, points, changed = merge_cache.ENGINE.merge_line(temp_vals)
+            if not changed:
+                continue
             
+            score += points
+            lines_touched.append(line_index)
             for index in range(len(merged_vals)):
-                self._grid[offset_coords[index][0]][offset_coords[index][1]] = merged_vals[index]
+                self.set_tile(offset_coords[index][0], offset_coords[index][1],
+                              merged_vals[index])
+            if not merge_cache.ENGINE.merge_line(merged_vals)[2]:
+                self._active_lines[direction].discard(line_index)
             
-        after_move = str(self._grid)
-        if before_move != after_move:
+        moved = len(lines_touched) > 0
+        if moved:
+            if self._history.maxlen:
+                self._history.append(before_move)
             self.new_tile()
+        return MoveResult(moved, score, lines_touched)
         
     
     def find_empty_coords(self):
         """
         Searches for and returns a random empty element.
+        Returns None if the board is full.
         """
-        try:
-            for dummy_i in range((self._grid_height * self._grid_width)):
-                random_row = random.choice(range(self._grid_height))
-                random_col = random.choice(range(self._grid_width))
-                random_sq = self._grid[random_row][random_col]
-                if random_sq == 0:
-                    return [random_row] + [random_col]
-        except IndexError:
+        if not self._empty_cells:
             return None
+        random_row, random_col = self._rng.choice(self._empty_cells)
+        return [random_row] + [random_col]
+        
+    
+    def get_empty_count(self):
+        """
+        Returns the number of empty squares.
+        """
+        return len(self._empty_cells)
+        
+    
+    def legal_moves(self):
+        """
+        Returns the list of directions that would change the board,
+        found with one scan over all pairs of neighbouring tiles.
+        A tile can move towards an empty neighbour, and two equal
+        neighbours can merge in both directions along their line.
+        """
+        legal = set()
+        for row in range(self._grid_height):
+            for col in range(self._grid_width):
+                tile = self._grid[row][col]
+                if col + 1 < self._grid_width:
+                    right = self._grid[row][col + 1]
+                    if tile == 0 and right != 0:
+                        legal.add(LEFT)
+                    elif tile != 0 and right == 0:
+                        legal.add(RIGHT)
+                    elif tile != 0 and tile == right:
+                        legal.add(LEFT)
+                        legal.add(RIGHT)
+                if row + 1 < self._grid_height:
+                    below = self._grid[row + 1][col]
+                    if tile == 0 and below != 0:
+                        legal.add(UP)
+                    elif tile != 0 and below == 0:
+                        legal.add(DOWN)
+                    elif tile != 0 and tile == below:
+                        legal.add(UP)
+                        legal.add(DOWN)
+                if len(legal) == 4:
+                    return [UP, DOWN, LEFT, RIGHT]
+        return [direction for direction in [UP, DOWN, LEFT, RIGHT]
+                if direction in legal]
+        
+    
+    def is_game_over(self):
+        """
+        Returns True if the board is full and no two
+        neighbouring tiles are equal.
+        """
+        if self._empty_cells:
+            return False
+        for row in range(self._grid_height):
+            for col in range(self._grid_width):
+                tile = self._grid[row][col]
+                if col + 1 < self._grid_width and tile == self._grid[row][col + 1]:
+                    return False
+                if row + 1 < self._grid_height and tile == self._grid[row + 1][col]:
+                    return False
+        return True
         
     
     def new_tile(self):
@@ -216,10 +303,11 @@ class TwentyFortyEight:
             random_col = random_empty_coords[1]
         
             # Set value of random tile
-            # Value is chosen from a list with the
-            # didtribution specified above
-            value_dist = ([2] * 90) + ([4] * 10) 
-            self.set_tile(random_row, random_col, random.choice(value_dist))
+            # with the distribution specified above
+            if self._rng.random() < 0.9:
+                self.set_tile(random_row, random_col, 2)
+            else:
+                self.set_tile(random_row, random_col, 4)
         else:
             return "Game is over!!!"
         
@@ -229,7 +317,76 @@ class TwentyFortyEight:
         Set the tile at position row, col 
         to have the given value.
         """
+        old_value = self._grid[row][col]
+        if old_value == value:
+            return
         self._grid[row][col] = value
+        self._row_cache[row] = None
+        self._active_lines[UP].add(col)
+        self._active_lines[DOWN].add(col)
+        self._active_lines[LEFT].add(row)
+        self._active_lines[RIGHT].add(row)
+        if old_value == 0 and value != 0:
+            self._remove_empty((row, col))
+        elif old_value != 0 and value == 0:
+            self._add_empty((row, col))
+
+    
+    def snapshot(self):
+        """
+        Returns the state of the grid as a tuple of row tuples.
+        Rows that have not changed since the previous snapshot
+        are shared with it instead of being copied.
+        """
+        for row in range(self._grid_height):
+            if self._row_cache[row] is None:
+                self._row_cache[row] = tuple(self._grid[row])
+        return tuple(self._row_cache)
+
+    
+    def restore(self, snapshot):
+        """
+        Puts the grid back into the state of a snapshot,
+        rewriting only the rows that differ from it.
+        """
+        for row in range(self._grid_height):
+            row_values = snapshot[row]
+            if self._row_cache[row] is row_values:
+                continue
+            for col in range(self._grid_width):
+                self.set_tile(row, col, row_values[col])
+            self._row_cache[row] = row_values
+
+    
+    def undo(self):
+        """
+        Takes back the last move.  Returns False if there
+        is no move left to undo.
+        """
+        if not self._history:
+            return False
+        self.restore(self._history.pop())
+        return True
+
+    
+    def _add_empty(self, cell):
+        """
+        Adds a cell to the empty cell index.
+        """
+        self._empty_positions[cell] = len(self._empty_cells)
+        self._empty_cells.append(cell)
+
+    
+    def _remove_empty(self, cell):
+        """
+        Removes a cell from the empty cell index by moving
+        the last cell of the list into its slot.
+        """
+        index = self._empty_positions.pop(cell)
+        last_cell = self._empty_cells.pop()
+        if last_cell != cell:
+            self._empty_cells[index] = last_cell
+            self._empty_positions[last_cell] = index
 
     
     def get_tile(self, row, col):
@@ -274,6 +431,8 @@ def run_test_suite():
                    4, "Test #13:")
     suite.run_test(test_obj_one.create_ranges_cache(testing=True)[LEFT], 
                    4, "Test #14:")
+    suite.run_test(test_obj_one.create_lines_cache(testing=True)[DOWN][1], 
+                   [(3, 1), (2, 1), (1, 1), (0, 1)], "Test #14:")
         
     # Testing reset and new_tile methods:
     test_obj_one.reset()
@@ -300,14 +459,92 @@ def run_test_suite():
     test_obj_two.set_tile(3, 3, 11)
     suite.run_test(test_obj_two.get_tile(3, 3), 
                    11, "Test #18:")
+    
+    # Testing move results:
+    test_obj_three = TwentyFortyEight(4, 4)
+    for row in range(4):
+        for col in range(4):
+            test_obj_three.set_tile(row, col, 0)
+    test_obj_three.set_tile(0, 0, 2)
+    test_obj_three.set_tile(1, 0, 2)
+    test_obj_three.set_tile(2, 0, 4)
+    result = test_obj_three.move(LEFT)
+    suite.run_test((result.moved, result.score, result.lines_touched), 
+                   (False, 0, []), "Test #19:")
+    result = test_obj_three.move(UP)
+    suite.run_test((result.moved, result.score, result.lines_touched), 
+                   (True, 4, [0]), "Test #20:")
+    suite.run_test(test_obj_three.get_tile(1, 0), 
+                   4, "Test #21:")
+    
+    # Testing the empty cell index:
+    suite.run_test(test_obj_three.get_empty_count(), 
+                   13, "Test #22:")
+    for row in range(4):
+        for col in range(4):
+            test_obj_three.set_tile(row, col, 2 ** (row * 4 + col + 1))
+    suite.run_test(test_obj_three.find_empty_coords(), 
+                   None, "Test #23:")
+    suite.run_test(test_obj_three.new_tile(), 
+                   "Game is over!!!", "Test #24:")
+    suite.run_test(test_obj_three.legal_moves(), 
+                   [], "Test #24:")
+    suite.run_test(test_obj_three.is_game_over(), 
+                   True, "Test #24:")
+    test_obj_three.set_tile(2, 1, 0)
+    suite.run_test(test_obj_three.find_empty_coords(), 
+                   [2, 1], "Test #25:")
+    suite.run_test(test_obj_three.legal_moves(), 
+                   [UP, DOWN, LEFT, RIGHT], "Test #25:")
+    suite.run_test(test_obj_three.is_game_over(), 
+                   False, "Test #25:")
+    test_obj_three.set_tile(2, 1, 1024)
+    test_obj_three.set_tile(3, 3, test_obj_three.get_tile(3, 2))
+    suite.run_test(test_obj_three.legal_moves(), 
+                   [LEFT, RIGHT], "Test #25:")
+    test_obj_three.set_tile(3, 3, 0)
+    suite.run_test(test_obj_three.legal_moves(), 
+                   [DOWN, RIGHT], "Test #25:")
+    
+    # Testing snapshots and undo:
+    test_obj_six = TwentyFortyEight(4, 4, undo_limit=2)
+    for row in range(4):
+        for col in range(4):
+            test_obj_six.set_tile(row, col, 0)
+    test_obj_six.set_tile(0, 1, 2)
+    first = test_obj_six.snapshot()
+    suite.run_test(test_obj_six.snapshot()[1] is first[1], 
+                   True, "Test #27:")
+    test_obj_six.set_tile(0, 2, 2)
+    second = test_obj_six.snapshot()
+    suite.run_test((second[0] is first[0], second[3] is first[3]), 
+                   (False, True), "Test #28:")
+    for direction in [LEFT, UP, RIGHT]:
+        test_obj_six.move(direction)
+    suite.run_test(test_obj_six.undo(), True, "Test #29:")
+    suite.run_test(test_obj_six.undo(), True, "Test #30:")
+    suite.run_test(test_obj_six.undo(), False, "Test #31:")
+    test_obj_six.restore(first)
+    suite.run_test(test_obj_six.snapshot(), first, "Test #32:")
+    suite.run_test(test_obj_six.get_empty_count(), 15, "Test #33:")
+    
+    # Testing seeded games:
+    test_obj_four = TwentyFortyEight(4, 4, random.Random(7))
+    test_obj_five = TwentyFortyEight(4, 4, random.Random(7))
+    for direction in [UP, LEFT, DOWN, RIGHT, UP]:
+        test_obj_four.move(direction)
+        test_obj_five.move(direction)
+    suite.run_test(str(test_obj_four), str(test_obj_five), "Test #26:")
 
     # Collect and report results:
     suite.report_results()
 
 
-# Run test suite:
-run_test_suite()
-
+if __name__ == "__main__":
+    # Run test suite:
+    run_test_suite()
 
-# Run 2048 game:
-poc_2048_gui.run_gui(TwentyFortyEight(4, 4))
\ No newline at end of file
+    # Run 2048 game (the GUI is only needed here, so importing
+    # this module stays headless):
+    import poc_2048_gui
+    poc_2048_gui.run_gui(TwentyFortyEight(4, 4))
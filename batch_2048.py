@@ -0,0 +1,252 @@
+"""
+Batched 2048 simulation with NumPy.
+
+Holds many games of the same size in one (N, H, W) array of tile
+exponents (0 is an empty cell, 1 is a 2, 2 is a 4, ...) and steps
+all of them at once.
+"""
+
+import time
+import numpy as np
+import simpletest
+
+from game_2048 import UP, DOWN, LEFT, RIGHT, DIRECTIONS
+
+# Probability that a new tile is a 4 instead of a 2:
+PROB_FOUR = 0.1
+
+
+def compact_left(lines):
+    """
+    Slides the non-zero exponents of every line in an
+    (M, L) array to the front, keeping their order.
+    """
+    order = np.argsort(lines == 0, axis=1, kind="stable")
+    return np.take_along_axis(lines, order, axis=1)
+
+
+def merge_left(lines):
+    """
+    Merges every line of an (M, L) exponent array towards index 0.
+    Returns the merged lines and the points gained per line.
+    """
+    merged = compact_left(lines)
+    points = np.zeros(merged.shape[0], dtype=np.int64)
+    for index in range(merged.shape[1] - 1):
+        first = merged[:, index]
+        second = merged[:, index + 1]
+        pairs = (first != 0) & (first == second)
+        first[pairs] += 1
+        second[pairs] = 0
+        points += np.where(pairs, np.left_shift(1, first.astype(np.int64)), 0)
+    return compact_left(merged), points
+
+
+def _to_left(boards, direction):
+    """
+    Returns a view of the boards in which the given direction
+    becomes a move to the left.
+    """
+    if direction == RIGHT:
+        return boards[:, :, ::-1]
+    elif direction == UP:
+        return boards.transpose(0, 2, 1)
+    elif direction == DOWN:
+        return boards.transpose(0, 2, 1)[:, :, ::-1]
+    return boards
+
+
+def _from_left(boards, direction):
+    """
+    Undoes _to_left().
+    """
+    if direction == RIGHT:
+        return boards[:, :, ::-1]
+    elif direction == UP:
+        return boards.transpose(0, 2, 1)
+    elif direction == DOWN:
+        return boards[:, :, ::-1].transpose(0, 2, 1)
+    return boards
+
+
+def move_boards(boards, direction):
+    """
+    Moves every board of an (M, H, W) exponent array in one
+    direction.  Returns the new boards and the points per board.
+    """
+    turned = _to_left(boards, direction)
+    num_boards, num_lines, length = turned.shape
+    merged, points = merge_left(turned.reshape(num_boards * num_lines,
+                                               length))
+    merged = merged.reshape(num_boards, num_lines, length)
+    return (_from_left(merged, direction),
+            points.reshape(num_boards, num_lines).sum(axis=1))
+
+
+def can_move(boards):
+    """
+    Returns a boolean mask of the boards in an (N, H, W) array
+    that still have an empty cell or two equal neighbours.
+    """
+    full = (boards != 0).all(axis=(1, 2))
+    horizontal = (boards[:, :, 1:] == boards[:, :, :-1]).any(axis=(1, 2))
+    vertical = (boards[:, 1:, :] == boards[:, :-1, :]).any(axis=(1, 2))
+    return ~full | horizontal | vertical
+
+
+class BatchTwentyFortyEight:
+    """
+    Runs num_games games of 2048 in lockstep.
+    """
+
+    def __init__(self, num_games, grid_height, grid_width, seed = None):
+        self._num_games = num_games
+        self._grid_height = grid_height
+        self._grid_width = grid_width
+        self._random = np.random.RandomState(seed)
+        self.reset()
+
+
+    def reset(self):
+        """
+        Reset every game to an empty grid with two initial tiles.
+        """
+        self._boards = np.zeros((self._num_games, self._grid_height,
+                                 self._grid_width), dtype=np.int8)
+        self._scores = np.zeros(self._num_games, dtype=np.int64)
+        all_games = np.ones(self._num_games, dtype=bool)
+        for dummy_i in range(2):
+            self.new_tiles(all_games)
+
+
+    def get_num_games(self):
+        """
+        Returns the number of games in the batch.
+        """
+        return self._num_games
+
+
+    def get_boards(self):
+        """
+        Returns the (N, H, W) array of tile exponents.
+        """
+        return self._boards
+
+
+    def get_tiles(self):
+        """
+        Returns the (N, H, W) array of tile values.
+        """
+        tiles = np.left_shift(1, self._boards.astype(np.int64))
+        tiles[self._boards == 0] = 0
+        return tiles
+
+
+    def get_scores(self):
+        """
+        Returns the total points gained by each game.
+        """
+        return self._scores
+
+
+    def new_tiles(self, mask):
+        """
+        Spawns one tile in a uniformly chosen empty cell of every
+        game selected by the boolean mask, using a single random
+        draw for the whole batch.
+        """
+        flat = self._boards.reshape(self._num_games, -1)
+        keys = self._random.random_sample(flat.shape)
+        keys[flat != 0] = -1.0
+        cells = keys.argmax(axis=1)
+        has_empty = keys.max(axis=1) >= 0.0
+        games = np.nonzero(mask & has_empty)[0]
+        fours = self._random.random_sample(self._num_games) < PROB_FOUR
+        flat[games, cells[games]] = np.where(fours[games], 2, 1)
+
+
+    def step(self, directions):
+        """
+        Moves game i in directions[i] and spawns a tile in every
+        game that changed.  Returns three arrays: the points each
+        game gained, the games that moved and the games that are over.
+        """
+        directions = np.asarray(directions)
+        rewards = np.zeros(self._num_games, dtype=np.int64)
+        moved = np.zeros(self._num_games, dtype=bool)
+        for direction in DIRECTIONS:
+            games = np.nonzero(directions == direction)[0]
+            if len(games) == 0:
+                continue
+            old_boards = self._boards[games]
+            new_boards, points = move_boards(old_boards, direction)
+            self._boards[games] = new_boards
+            rewards[games] = points
+            moved[games] = (new_boards != old_boards).any(axis=(1, 2))
+
+        self.new_tiles(moved)
+        self._scores += rewards
+        return rewards, moved, ~can_move(self._boards)
+
+
+def run_example(num_games = 10000, grid_height = 4, grid_width = 4):
+    """
+    Plays random moves in a batch of games until all are over
+    and prints the throughput.
+    """
+    batch = BatchTwentyFortyEight(num_games, grid_height, grid_width, seed = 0)
+    directions_random = np.random.RandomState(1)
+    done = ~can_move(batch.get_boards())
+    steps = 0
+    start = time.time()
+    while not done.all():
+        directions = directions_random.randint(1, 5, size = num_games)
+        done = batch.step(directions)[2]
+        steps += 1
+    elapsed = time.time() - start
+
+    print "Games:", num_games, "Steps:", steps, "Time:", elapsed
+    print "Games/sec:", num_games / elapsed, \
+          "Moves/sec:", num_games * steps / elapsed
+    print "Mean score:", batch.get_scores().mean()
+
+
+def run_test_suite():
+    """
+    Some informal tests
+    """
+    suite = simpletest.TestSuite()
+
+    lines = np.array([[1, 1, 2, 0], [1, 0, 1, 1], [3, 4, 4, 3]],
+                     dtype=np.int8)
+    merged, points = merge_left(lines)
+    suite.run_test(merged.tolist(), [[2, 2, 0, 0], [2, 1, 0, 0],
+                                     [3, 5, 3, 0]], "Test #1:")
+    suite.run_test(points.tolist(), [4, 4, 32], "Test #2:")
+    suite.run_test(lines.tolist()[0], [1, 1, 2, 0], "Test #3:")
+
+    boards = np.array([[[1, 0], [1, 2]], [[1, 2], [2, 1]]], dtype=np.int8)
+    moved, points = move_boards(boards, UP)
+    suite.run_test(moved.tolist(), [[[2, 2], [0, 0]], [[1, 2], [2, 1]]],
+                   "Test #4:")
+    suite.run_test(points.tolist(), [4, 0], "Test #5:")
+    moved, points = move_boards(boards, RIGHT)
+    suite.run_test(moved.tolist(), [[[0, 1], [1, 2]], [[1, 2], [2, 1]]],
+                   "Test #6:")
+    suite.run_test(can_move(boards).tolist(), [True, False], "Test #7:")
+
+    batch = BatchTwentyFortyEight(2, 2, 2, seed = 0)
+    batch.get_boards()[:] = boards
+    rewards, moved, over = batch.step([DOWN, LEFT])
+    suite.run_test(rewards.tolist(), [4, 0], "Test #8:")
+    suite.run_test(moved.tolist(), [True, False], "Test #9:")
+    suite.run_test(over.tolist(), [False, True], "Test #10:")
+    suite.run_test(int((batch.get_boards()[0] != 0).sum()), 3, "Test #11:")
+    suite.run_test(batch.get_scores().tolist(), [4, 0], "Test #12:")
+
+    suite.report_results()
+
+
+if __name__ == "__main__":
+    run_test_suite()
+    run_example()
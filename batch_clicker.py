@@ -0,0 +1,265 @@
+"""
+Batched Cookie Clicker simulation with NumPy.
+
+Advances many configurations (growth factor, item costs and CPS) in
+lockstep, one purchase per configuration per step, with the best
+cps/cost ratio strategy applied as a single argmax over all of them.
+Every configuration follows exactly the arithmetic of simulate_clicker
+with strategy_best, so the results match the scalar simulator.
+"""
+
+import time
+import numpy as np
+import clicker
+import cookie_clicker
+import simpletest
+
+
+SIM_TIME = 10000000000.0
+
+
+class BatchClicker:
+    """
+    Many Cookie Clicker games with the same items, one row per game.
+    """
+
+    def __init__(self, costs, item_cps, growth_factors, duration = SIM_TIME):
+        """
+        costs and item_cps are (N, I) arrays of starting item costs
+        and CPS (or (I,) arrays shared by all games), growth_factors
+        is an (N,) array.
+        """
+        self._growth = np.asarray(growth_factors, dtype = np.float64)
+        num_games = self._growth.shape[0]
+        self._base_costs = np.broadcast_to(
+            np.asarray(costs, dtype = np.float64),
+            (num_games, np.shape(costs)[-1])).copy()
+        self._item_cps = np.broadcast_to(
+            np.asarray(item_cps, dtype = np.float64),
+            self._base_costs.shape).copy()
+        self._duration = float(duration)
+        self.reset()
+
+
+    def reset(self):
+        """
+        Start every game over.
+        """
+        num_games = self._growth.shape[0]
+        self._cookies = np.zeros(num_games)
+        self._total = np.zeros(num_games)
+        self._cps = np.ones(num_games)
+        self._time = np.zeros(num_games)
+        self._costs = self._base_costs.copy()
+        self._purchases = np.zeros(self._costs.shape, dtype = np.int64)
+        self._done = np.zeros(num_games, dtype = bool)
+
+
+    def get_num_games(self):
+        """
+        Returns the number of games in the batch.
+        """
+        return self._growth.shape[0]
+
+
+    def get_cookies(self):
+        """
+        Returns the (N,) array of current cookies.
+        """
+        return self._cookies
+
+
+    def get_total_cookies(self):
+        """
+        Returns the (N,) array of total cookies earned.
+        """
+        return self._total
+
+
+    def get_cps(self):
+        """
+        Returns the (N,) array of current CPS.
+        """
+        return self._cps
+
+
+    def get_time(self):
+        """
+        Returns the (N,) array of current times.
+        """
+        return self._time
+
+
+    def get_costs(self):
+        """
+        Returns the (N, I) array of current item costs.
+        """
+        return self._costs
+
+
+    def get_purchases(self):
+        """
+        Returns the (N, I) array of items bought.
+        """
+        return self._purchases
+
+
+    def get_done(self):
+        """
+        Returns the (N,) mask of games that bought their last item.
+        """
+        return self._done
+
+
+    def step(self):
+        """
+        Lets every game that is not done pick the affordable item
+        with the best cps/cost ratio, wait for it and buy it.
+        Returns the number of games still running.
+        """
+        active = np.flatnonzero(~self._done)
+        cookies = self._cookies[active]
+        cps = self._cps[active]
+        now = self._time[active]
+        costs = self._costs[active]
+        time_left = self._duration - now
+
+        # Strategy: best ratio among the items affordable in the time
+        # left; argmax keeps the first item on ties, like the scalar one
+        budget = cookies + cps * time_left
+        ratios = np.where(costs <= budget[:, None],
+                          self._item_cps[active] / costs, -np.inf)
+        choice = np.argmax(ratios, axis = 1)
+        rows = np.arange(active.shape[0])
+        cost = costs[rows, choice]
+        wait = np.where(cookies >= cost, 0.0,
+                        np.ceil((cost - cookies) / cps))
+        buying = np.isfinite(ratios[rows, choice]) & (wait <= time_left)
+        self._done[active[~buying]] = True
+
+        active = active[buying]
+        choice = choice[buying]
+        cost = cost[buying]
+        wait = wait[buying]
+        cps = cps[buying]
+        cookies = cookies[buying] + wait * cps
+        self._total[active] = self._total[active] + wait * cps
+        self._time[active] = now[buying] + wait
+        bought = cookies >= cost
+        self._cookies[active] = np.where(bought, cookies - cost, cookies)
+        self._cps[active] = np.where(bought,
+                                     cps + self._item_cps[active, choice], cps)
+        self._purchases[active, choice] += bought
+        self._costs[active, choice] = cost * self._growth[active]
+        return active.shape[0]
+
+
+    def run(self):
+        """
+        Steps every game to the end and waits out the time left.
+        Returns the number of steps taken.
+        """
+        steps = 0
+        while self.step():
+            steps += 1
+        time_left = self._duration - self._time
+        waiting = time_left > 0
+        self._cookies = np.where(waiting, self._cookies + time_left * self._cps,
+                                 self._cookies)
+        self._total = np.where(waiting, self._total + time_left * self._cps,
+                               self._total)
+        self._time = np.where(waiting, self._time + time_left, self._time)
+        return steps
+
+
+def sweep(growth_factors, cost_scales = (1.0,), cps_scales = (1.0,),
+          build_info = None, duration = SIM_TIME):
+    """
+    Runs every combination of growth factor, cost scale and CPS scale
+    of a build info dictionary (the default one if None) and returns
+    a dictionary of (N,) arrays: "growth_factor", "cost_scale",
+    "cps_scale", "total_cookies", "cps" and "purchases" (N, I),
+    along with the list of "items" in column order.
+    """
+    info = clicker.BuildInfo(build_info)
+    items = info.build_items()
+    costs = np.array([info.get_cost(item) for item in items])
+    item_cps = np.array([info.get_cps(item) for item in items])
+    growth, cost_scale, cps_scale = [
+        grid.ravel() for grid in np.meshgrid(growth_factors, cost_scales,
+                                             cps_scales, indexing = "ij")]
+    batch = BatchClicker(costs * cost_scale[:, None],
+                         item_cps * cps_scale[:, None], growth, duration)
+    batch.run()
+    return {"items": items,
+            "growth_factor": growth,
+            "cost_scale": cost_scale,
+            "cps_scale": cps_scale,
+            "total_cookies": batch.get_total_cookies(),
+            "cps": batch.get_cps(),
+            "purchases": batch.get_purchases()}
+
+
+def run_example(num_growth = 100, num_scales = 20):
+    """
+    Sweeps growth factors and cost scales of the default build
+    info and prints the throughput and the best configuration.
+    """
+    start = time.time()
+    results = sweep(np.linspace(1.05, 1.3, num_growth),
+                    np.linspace(0.5, 2.0, num_scales))
+    elapsed = time.time() - start
+    num_configs = results["growth_factor"].shape[0]
+    purchases = results["purchases"].sum()
+
+    print "Configurations:", num_configs, "Time:", elapsed
+    print "Configurations/sec:", num_configs / elapsed, \
+          "Purchases/sec:", purchases / elapsed
+    best = np.argmax(results["total_cookies"])
+    print "Most cookies:", results["total_cookies"][best], \
+          "growth factor:", results["growth_factor"][best], \
+          "cost scale:", results["cost_scale"][best]
+
+
+def run_test_suite():
+    """
+    Some informal tests
+    """
+    suite = simpletest.TestSuite()
+
+    # Every game of a sweep ends exactly where simulate_clicker does
+    growth_factors = [1.1, 1.15, 1.3]
+    cost_scales = [0.5, 2.0]
+    results = sweep(growth_factors, cost_scales, duration = 1e6)
+    index = 0
+    for growth in growth_factors:
+        for scale in cost_scales:
+            info = dict((item, [cost * scale, cps]) for item, (cost, cps)
+                        in clicker.DEFAULT_BUILD_INFO.items())
+            state = cookie_clicker.simulate_clicker(
+                clicker.BuildInfo(info, growth), 1e6,
+                cookie_clicker.strategy_best)
+            bought = state.get_history_store().get_count() - 1
+            suite.run_test((results["total_cookies"][index],
+                            results["cps"][index],
+                            int(results["purchases"][index].sum())),
+                           (state.get_total_cookies(), state.get_cps(),
+                            bought), "Test #" + str(index + 1) + ":")
+            index += 1
+
+    # One item of cost 10 that never gets dearer: bought at times
+    # 10, 15, 19, 21, 23 and 25
+    batch = BatchClicker([10.0], [1.0], [1.0], duration = 25.0)
+    suite.run_test(batch.step(), 1, "Test #7:")
+    suite.run_test((batch.get_time()[0], batch.get_cookies()[0],
+                    batch.get_cps()[0]), (10.0, 0.0, 2.0), "Test #8:")
+    suite.run_test(batch.run(), 5, "Test #9:")
+    suite.run_test((batch.get_purchases()[0, 0], batch.get_time()[0],
+                    batch.get_done()[0]), (6, 25.0, True), "Test #10:")
+
+    suite.report_results()
+
+
+if __name__ == "__main__":
+    run_test_suite()
+    run_example()
@@ -0,0 +1,314 @@
+"""
+Headless self-play benchmark for the 2048 game.
+
+Drives TwentyFortyEight with a few simple policies over several grid
+sizes, reports moves/sec, merges/sec, the objects left allocated by
+each run and its peak memory,
+and writes the results as JSON so they can be compared against a
+stored baseline.  Each policy and grid size runs in a fresh Python
+process, so that its peak memory is its own.
+
+Usage: python benchmark_2048.py [--output results.json]
+                                [--baseline baseline.json]
+                                [--in-process]
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import simpletest
+import time
+import merge as merge_cache
+
+from game_2048 import twenty_forty_eight, UP, DOWN, LEFT, RIGHT, DIRECTIONS
+
+# Benchmark configuration:
+GRID_SIZES = [(4, 4), (5, 5), (8, 8), (32, 32)]
+NUM_GAMES = 5          # Games per policy and grid size
+MAX_MOVES = 2000       # Moves per game before it is cut short
+SEED = 2048
+
+# Relative drop in moves/sec that counts as a regression:
+TOLERANCE = 0.1
+
+
+def peek_score(game, direction):
+    """
+    Returns the points a move would gain without making it,
+    or None if the move would not change the board.
+    """
+    height = game.get_grid_height()
+    width = game.get_grid_width()
+    if direction in (UP, DOWN):
+        lines = [[game.get_tile(row, col) for row in range(height)]
+                 for col in range(width)]
+    else:
+        lines = [[game.get_tile(row, col) for col in range(width)]
+                 for row in range(height)]
+    score = 0
+    moved = False
+    for line in lines:
+        if direction in (DOWN, RIGHT):
+            line.reverse()
+        dummy_merged, points, changed = merge_cache.ENGINE.merge_line(line)
+        moved = moved or changed
+        score += points
+    if moved:
+        return score
+    return None
+
+
+def play_in_order(game, directions):
+    """
+    Makes the first move of the list that changes the board.
+    Returns its MoveResult, or None if no move is possible.
+    """
+    for direction in directions:
+        result = game.move(direction)
+        if result.moved:
+            return result
+    return None
+
+
+def policy_random(game):
+    """
+    Moves in a random direction.
+    """
+    directions = list(DIRECTIONS)
+    random.shuffle(directions)
+    return play_in_order(game, directions)
+
+
+def policy_greedy(game):
+    """
+    Makes the move that scores the most points right now.
+    """
+    scores = [(peek_score(game, direction), direction)
+              for direction in DIRECTIONS]
+    scores = [(score, direction) for score, direction in scores
+              if score is not None]
+    if not scores:
+        return None
+    return game.move(max(scores)[1])
+
+
+def policy_corner(game):
+    """
+    Keeps the big tiles in the top left corner.
+    """
+    return play_in_order(game, [LEFT, UP, RIGHT, DOWN])
+
+
+POLICIES = {"random": policy_random,
+            "greedy": policy_greedy,
+            "corner": policy_corner}
+
+
+def run_policy(policy, grid_height, grid_width, num_games, max_moves):
+    """
+    Plays num_games games with one policy and returns a dictionary
+    with the counters and rates of the run.  retained_objects is the
+    growth of the number of objects tracked by the garbage collector
+    over the run (objects still allocated at its end, not every
+    allocation made); peak_memory is the peak RSS of the process.
+    """
+    moves = 0
+    merges = 0
+    score = 0
+    gc.collect()
+    objects_before = len(gc.get_objects())
+    start = time.time()
+    for dummy_game in range(num_games):
+        game = twenty_forty_eight.TwentyFortyEight(grid_height, grid_width)
+        for dummy_move in range(max_moves):
+            empty_before = game.get_empty_count()
+            result = policy(game)
+            if result is None:
+                break
+            moves += 1
+            score += result.score
+            # Every tile that disappears was merged away; the new
+            # tile spawned after the move accounts for the + 1.
+            merges += game.get_empty_count() - empty_before + 1
+    elapsed = time.time() - start
+
+    # ru_maxrss is reported in kilobytes on Linux; it is the peak
+    # of the whole process, see run_isolated()
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    retained_objects = len(gc.get_objects()) - objects_before
+
+    return {"games": num_games,
+            "moves": moves,
+            "merges": merges,
+            "score": score,
+            "seconds": elapsed,
+            "moves_per_sec": moves / elapsed if elapsed else 0.0,
+            "merges_per_sec": merges / elapsed if elapsed else 0.0,
+            "retained_objects": retained_objects,
+            "peak_memory": peak_memory}
+
+
+def run_seeded(name, grid_height, grid_width, num_games, max_moves, seed):
+    """
+    Seeds the random module and runs the named policy.
+    """
+    random.seed(seed)
+    return run_policy(POLICIES[name], grid_height, grid_width, num_games,
+                      max_moves)
+
+
+def run_isolated(name, grid_height, grid_width, num_games, max_moves, seed):
+    """
+    Runs the named policy in a fresh Python process and returns its
+    results, so that the peak RSS of earlier runs is not included.
+    """
+    args = json.dumps([name, grid_height, grid_width, num_games,
+                       max_moves, seed])
+    worker = subprocess.Popen(
+        [sys.executable, "-c", "import sys, benchmark_2048; "
+         "benchmark_2048.worker_main(sys.argv[1])", args],
+        cwd = os.path.dirname(os.path.abspath(__file__)),
+        stdout = subprocess.PIPE)
+    output = worker.communicate()[0]
+    if worker.returncode != 0:
+        raise RuntimeError("benchmark worker failed: " + args)
+    return json.loads(output)
+
+
+def worker_main(args):
+    """
+    Entry point of the processes started by run_isolated().
+    """
+    print json.dumps(run_seeded(*json.loads(args)))
+
+
+def run_benchmark(grid_sizes = GRID_SIZES, num_games = NUM_GAMES,
+                  max_moves = MAX_MOVES, seed = SEED, isolated = True):
+    """
+    Runs every policy on every grid size and returns the results
+    keyed by "<policy> <height>x<width>".  Unless isolated is False,
+    every run gets its own process.
+    """
+    if isolated:
+        run = run_isolated
+    else:
+        run = run_seeded
+    results = {}
+    for grid_height, grid_width in grid_sizes:
+        for name in sorted(POLICIES):
+            key = name + " " + str(grid_height) + "x" + str(grid_width)
+            results[key] = run(name, grid_height, grid_width, num_games,
+                               max_moves, seed)
+            print key, ":", int(results[key]["moves_per_sec"]), "moves/sec,", \
+                  int(results[key]["merges_per_sec"]), "merges/sec"
+    return results
+
+
+def compare_results(results, baseline, tolerance = TOLERANCE):
+    """
+    Returns the list of keys whose moves/sec dropped by more than
+    tolerance relative to the baseline.
+    """
+    regressions = []
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        old_rate = baseline[key]["moves_per_sec"]
+        new_rate = results[key]["moves_per_sec"]
+        if old_rate > 0 and new_rate < old_rate * (1.0 - tolerance):
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    """
+    Runs the benchmark from the command line.
+    """
+    parser = argparse.ArgumentParser(description = "2048 self-play benchmark")
+    parser.add_argument("--output", default = "benchmark_2048.json",
+                        help = "where to write the JSON results")
+    parser.add_argument("--baseline",
+                        help = "JSON results to compare against")
+    parser.add_argument("--games", type = int, default = NUM_GAMES)
+    parser.add_argument("--max-moves", type = int, default = MAX_MOVES)
+    parser.add_argument("--tolerance", type = float, default = TOLERANCE)
+    parser.add_argument("--in-process", action = "store_true",
+                        help = "run everything in this process (peak "
+                        "memory is then a running maximum)")
+    args = parser.parse_args()
+
+    results = run_benchmark(num_games = args.games,
+                            max_moves = args.max_moves,
+                            isolated = not args.in_process)
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent = 2, sort_keys = True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_results(results, baseline, args.tolerance)
+        for key in regressions:
+            print "Regression:", key, int(baseline[key]["moves_per_sec"]), \
+                  "->", int(results[key]["moves_per_sec"]), "moves/sec"
+        if regressions:
+            raise SystemExit(1)
+
+
+def run_test_suite():
+    """
+    Some informal tests
+    """
+    suite = simpletest.TestSuite()
+
+    # Drops of more than the tolerance are regressions; keys
+    # missing from the baseline and zero baselines are skipped
+    baseline = {"a": {"moves_per_sec": 100.0},
+                "b": {"moves_per_sec": 100.0},
+                "d": {"moves_per_sec": 0.0}}
+    results = {"a": {"moves_per_sec": 80.0},
+               "b": {"moves_per_sec": 95.0},
+               "c": {"moves_per_sec": 1.0},
+               "d": {"moves_per_sec": 0.0}}
+    suite.run_test(compare_results(results, baseline), ["a"], "Test #1:")
+    suite.run_test(compare_results(results, baseline, 0.01), ["a", "b"],
+                   "Test #2:")
+    suite.run_test(compare_results(results, {}), [], "Test #3:")
+
+    # A row of 2 2 4 and nothing else
+    game = twenty_forty_eight.TwentyFortyEight(4, 4)
+    for row in range(4):
+        for col in range(4):
+            game.set_tile(row, col, 0)
+    game.set_tile(0, 0, 2)
+    game.set_tile(0, 1, 2)
+    game.set_tile(0, 2, 4)
+    suite.run_test([peek_score(game, direction) for direction in DIRECTIONS],
+                   [None, 0, 4, 4], "Test #4:")
+    suite.run_test([game.get_tile(0, col) for col in range(4)],
+                   [2, 2, 4, 0], "Test #5:")
+    game.set_tile(0, 3, 8)
+    suite.run_test([peek_score(game, direction) for direction in DIRECTIONS],
+                   [None, 0, 4, 4], "Test #6:")
+    game.set_tile(0, 1, 4)
+    suite.run_test([peek_score(game, LEFT), peek_score(game, RIGHT)],
+                   [8, 8], "Test #7:")
+    game.set_tile(0, 1, 32)
+    suite.run_test([peek_score(game, LEFT), peek_score(game, RIGHT)],
+                   [None, None], "Test #8:")
+
+    # Seeded runs are repeatable
+    first = run_seeded("corner", 4, 4, 1, 50, 1)
+    second = run_seeded("corner", 4, 4, 1, 50, 1)
+    suite.run_test((first["moves"], first["score"]),
+                   (second["moves"], second["score"]), "Test #9:")
+
+    suite.report_results()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""
+Bitboard engine for the 4x4 2048 game.
+
+The whole grid is packed into a single 64-bit integer.  Each cell
+holds the log2 exponent of its tile in 4 bits (0 is an empty cell),
+row r lives in bits 16 * r .. 16 * r + 15 and column c of a row lives
+in bits 4 * c .. 4 * c + 3.
+"""
+
+import collections
+import random
+import simpletest
+
+from game_2048 import UP, DOWN, LEFT, RIGHT, to_exponent
+
+GRID_SIZE = 4
+ROW_MASK = 0xFFFF
+COL_MASK = 0x000F000F000F000F
+
+# Result of a single move (same fields as in 2048.py): whether
+# any tile moved, the points gained and the indices of the rows
+# (LEFT/RIGHT) or columns (UP/DOWN) that changed:
+MoveResult = collections.namedtuple("MoveResult",
+                                    ["moved", "score", "lines_touched"])
+
+# Highest exponent that fits in a nibble (2 ** 15 = 32768).
+# Two tiles of this value are left alone instead of overflowing.
+MAX_EXPONENT = 15
+
+
+def _merge_row(exponents):
+    """
+    Merges a single row of exponents towards index 0 and
+    returns the merged row together with the points gained.
+    """
+    tiles = [exp for exp in exponents if exp != 0]
+    merged = []
+    score = 0
+    index = 0
+    while index < len(tiles):
+        if (index + 1 < len(tiles) and tiles[index] == tiles[index + 1]
+                and tiles[index] < MAX_EXPONENT):
+            merged.append(tiles[index] + 1)
+            score += 2 ** (tiles[index] + 1)
+            index += 2
+        else:
+            merged.append(tiles[index])
+            index += 1
+    return merged + [0] * (len(exponents) - len(merged)), score
+
+
+def _pack_row(exponents):
+    """
+    Packs four exponents into a 16-bit row.
+    """
+    row = 0
+    for col in range(GRID_SIZE):
+        row |= exponents[col] << (4 * col)
+    return row
+
+
+def _unpack_row(row):
+    """
+    Unpacks a 16-bit row into a list of four exponents.
+    """
+    return [(row >> (4 * col)) & 0xF for col in range(GRID_SIZE)]
+
+
+def _build_tables():
+    """
+    Precomputes the result of sliding every possible row left and
+    right, together with the points scored by the move.  The score
+    does not depend on the direction because runs of equal tiles
+    pair up the same number of times from either end.
+    """
+    left_table = [0] * (ROW_MASK + 1)
+    right_table = [0] * (ROW_MASK + 1)
+    score_table = [0] * (ROW_MASK + 1)
+    for row in range(ROW_MASK + 1):
+        exponents = _unpack_row(row)
+        merged, score = _merge_row(exponents)
+        left_table[row] = _pack_row(merged)
+        score_table[row] = score
+        reverse_merged = _merge_row(exponents[::-1])[0]
+        right_table[row] = _pack_row(reverse_merged[::-1])
+    return left_table, right_table, score_table
+
+
+# Row transition tables, one entry per 16-bit row:
+ROW_LEFT, ROW_RIGHT, ROW_SCORE = _build_tables()
+
+
+def transpose(board):
+    """
+    Returns the transposed board, so that columns can be moved
+    with the row tables.
+    """
+    part1 = board & 0xF0F00F0FF0F00F0F
+    part2 = board & 0x0000F0F00000F0F0
+    part3 = board & 0x0F0F00000F0F0000
+    board = part1 | (part2 << 12) | (part3 >> 12)
+    part1 = board & 0xFF00FF0000FF00FF
+    part2 = board & 0x00FF00FF00000000
+    part3 = board & 0x00000000FF00FF00
+    return part1 | (part2 >> 24) | (part3 << 24)
+
+
+def _apply_rows(board, table):
+    """
+    Runs every row of the board through a row transition table
+    and returns the new board together with the points gained.
+    """
+    result = 0
+    score = 0
+    for row_index in range(GRID_SIZE):
+        shift = 16 * row_index
+        row = (board >> shift) & ROW_MASK
+        result |= table[row] << shift
+        score += ROW_SCORE[row]
+    return result, score
+
+
+def execute_move(board, direction):
+    """
+    Moves all tiles of a packed board in the given direction.
+    Returns a tuple (new board, points gained); no tile is spawned.
+    """
+    if direction == LEFT:
+        return _apply_rows(board, ROW_LEFT)
+    elif direction == RIGHT:
+        return _apply_rows(board, ROW_RIGHT)
+    elif direction == UP:
+        moved, score = _apply_rows(transpose(board), ROW_LEFT)
+        return transpose(moved), score
+    elif direction == DOWN:
+        moved, score = _apply_rows(transpose(board), ROW_RIGHT)
+        return transpose(moved), score
+    raise ValueError("unknown direction: " + str(direction))
+
+
+def lines_touched(old_board, new_board, direction):
+    """
+    Returns the indices of the rows (LEFT/RIGHT) or columns
+    (UP/DOWN) that differ between two packed boards.
+    """
+    diff = old_board ^ new_board
+    if direction in (LEFT, RIGHT):
+        return [row for row in range(GRID_SIZE)
+                if (diff >> (16 * row)) & ROW_MASK]
+    return [col for col in range(GRID_SIZE)
+            if (diff >> (4 * col)) & COL_MASK]
+
+
+def _rows_change(board, table):
+    """
+    Returns True if any row of the board is changed by the table.
+    """
+    for row_index in range(GRID_SIZE):
+        row = (board >> (16 * row_index)) & ROW_MASK
+        if table[row] != row:
+            return True
+    return False
+
+
+def legal_moves(board):
+    """
+    Returns the list of directions that change a packed board,
+    looked up in the row tables without building the moved boards.
+    """
+    transposed = transpose(board)
+    legal = []
+    if _rows_change(transposed, ROW_LEFT):
+        legal.append(UP)
+    if _rows_change(transposed, ROW_RIGHT):
+        legal.append(DOWN)
+    if _rows_change(board, ROW_LEFT):
+        legal.append(LEFT)
+    if _rows_change(board, ROW_RIGHT):
+        legal.append(RIGHT)
+    return legal
+
+
+def empty_cells(board):
+    """
+    Returns the list of cell indices (4 * row + col) that are empty.
+    """
+    return [index for index in range(GRID_SIZE * GRID_SIZE)
+            if (board >> (4 * index)) & 0xF == 0]
+
+
+
+
+class BitboardTwentyFortyEight:
+    """
+    Drop-in replacement for TwentyFortyEight on 4x4 boards
+    backed by a 64-bit packed integer.
+    """
+    def __init__(self, grid_height=GRID_SIZE, grid_width=GRID_SIZE):
+        if grid_height != GRID_SIZE or grid_width != GRID_SIZE:
+            raise ValueError("bitboard backend only supports 4x4 grids")
+        self._grid_height = grid_height
+        self._grid_width = grid_width
+        self.reset()
+
+
+    def reset(self):
+        """
+        Reset the game so the grid is
+        empty except for two initial tiles.
+        """
+        self._board = 0
+        for dummy_i in range(2):
+            self.new_tile()
+
+
+    def __str__(self):
+        """
+        Returns a string representation
+        of the grid for debugging.
+        """
+        return str([list(row) for row in self.snapshot()])
+
+
+    def get_grid_height(self):
+        """
+        Returns the height of the board.
+        """
+        return self._grid_height
+
+
+    def get_grid_width(self):
+        """
+        Returns the width of the board.
+        """
+        return self._grid_width
+
+
+    def get_board(self):
+        """
+        Returns the packed 64-bit board.
+        """
+        return self._board
+
+
+    def set_board(self, board):
+        """
+        Replaces the packed 64-bit board.
+        """
+        self._board = board
+
+
+    def snapshot(self):
+        """
+        Returns the grid as a tuple of row tuples.
+        """
+        return tuple(tuple(self.get_tile(row, col) for col in range(GRID_SIZE))
+                     for row in range(GRID_SIZE))
+
+
+    def move(self, direction):
+        """
+        Moves all tiles in the given
+        direction and add a new tile
+        if any tiles moved.
+        Returns a MoveResult with the moved flag, the points
+        gained and the indices of the lines that changed.
+        """
+        new_board, score = execute_move(self._board, direction)
+        touched = lines_touched(self._board, new_board, direction)
+        if touched:
+            self._board = new_board
+            self.new_tile()
+        return MoveResult(len(touched) > 0, score, touched)
+
+
+    def legal_moves(self):
+        """
+        Returns the list of directions that would change the board.
+        """
+        return legal_moves(self._board)
+
+
+    def is_game_over(self):
+        """
+        Returns True if no move changes the board.
+        """
+        return not legal_moves(self._board)
+
+
+    def new_tile(self):
+        """
+        Creates a new tile in a randomly
+        selected empty square. The tile
+        will be 2 90% of the time
+        and 4 10% of the time.
+        """
+        empties = empty_cells(self._board)
+        if not empties:
+            return "Game is over!!!"
+        index = random.choice(empties)
+        if random.random() < 0.9:
+            exponent = 1
+        else:
+            exponent = 2
+        self._board |= exponent << (4 * index)
+
+
+    def set_tile(self, row, col, value):
+        """
+        Set the tile at position row, col
+        to have the given value.  Raises ValueError for values
+        above 2 ** MAX_EXPONENT, which do not fit in a cell.
+        """
+        exponent = to_exponent(value)
+        if exponent > MAX_EXPONENT:
+            raise ValueError("tile value too large: " + str(value))
+        shift = 16 * row + 4 * col
+        self._board = ((self._board & ~(0xF << shift))
+                       | (exponent << shift))
+
+
+    def get_tile(self, row, col):
+        """
+        Return the value of the tile
+        at position row, col.
+        """
+        exponent = (self._board >> (16 * row + 4 * col)) & 0xF
+        if exponent == 0:
+            return 0
+        return 2 ** exponent
+
+
+def run_test_suite():
+    """
+    Some informal tests
+    """
+    suite = simpletest.TestSuite()
+
+    # Row tables:
+    suite.run_test(_unpack_row(ROW_LEFT[_pack_row([1, 0, 1, 1])]),
+                   [2, 1, 0, 0], "Test #1:")
+    suite.run_test(_unpack_row(ROW_RIGHT[_pack_row([1, 0, 1, 1])]),
+                   [0, 0, 1, 2], "Test #2:")
+    suite.run_test(ROW_SCORE[_pack_row([3, 4, 4, 3])], 32, "Test #3:")
+    suite.run_test(ROW_LEFT[_pack_row([15, 15, 0, 0])],
+                   _pack_row([15, 15, 0, 0]), "Test #4:")
+
+    # Moves through the public API:
+    game = BitboardTwentyFortyEight()
+    game.set_board(0)
+    game.set_tile(0, 0, 2)
+    game.set_tile(1, 0, 2)
+    game.set_tile(3, 0, 4)
+    suite.run_test(execute_move(game.get_board(), UP)[1], 4, "Test #5:")
+    suite.run_test(game.move(DOWN), (True, 4, [0]), "Test #6:")
+    suite.run_test(game.get_tile(3, 0), 4, "Test #7:")
+    suite.run_test(game.get_tile(2, 0), 4, "Test #8:")
+
+    game.set_board(0)
+    game.set_tile(0, 0, 2)
+    suite.run_test(game.move(LEFT), (False, 0, []), "Test #9:")
+    suite.run_test(game.legal_moves(), [DOWN, RIGHT], "Test #10:")
+    suite.run_test(transpose(transpose(0x123456789ABCDEF0)),
+                   0x123456789ABCDEF0, "Test #11:")
+    suite.run_test(game.move(RIGHT).lines_touched, [0], "Test #12:")
+
+    # Tiles above 2 ** 15 do not fit and leave the board alone:
+    game.set_board(0)
+    game.set_tile(0, 0, 32768)
+    try:
+        game.set_tile(0, 1, 65536)
+        raised = False
+    except ValueError:
+        raised = True
+    suite.run_test((raised, game.get_board()), (True, MAX_EXPONENT),
+                   "Test #13:")
+
+    suite.report_results()
+
+
+if __name__ == "__main__":
+    run_test_suite()
@@ -2,32 +2,76 @@
 Cookie Clicker Simulator Build Information
 """
 
+import array
+import bisect
+import heapq
+import math
+
 BUILD_GROWTH = 1.15
 
-class BuildInfo:
+DEFAULT_BUILD_INFO = {"Cursor": [15.0, 0.1],
+                      "Grandma": [100.0, 0.5],
+                      "Farm": [500.0, 4.0],
+                      "Factory": [3000.0, 10.0],
+                      "Mine": [10000.0, 40.0],
+                      "Shipment": [40000.0, 100.0],
+                      "Alchemy Lab": [200000.0, 400.0],
+                      "Portal": [1666666.0, 6666.0],
+                      "Time Machine": [123456789.0, 98765.0],
+                      "Antimatter Condenser": [3999999999.0, 999999.0]}
+
+class BuildInfo(object):
     """
     Class to track build information.
+    
+    Items are numbered by id (their order in build_items(), which
+    can be given as items and is otherwise the one _default_items()
+    returns, sorted by name); costs and cps live in parallel arrays
+    indexed by id.  Clones share the cost array until one of them
+    updates an item (copy on write), so clone() is O(1).
+    
+    The costs are also kept as a sorted list of (cost, id) and a heap
+    of (-cps/cost, id, cost), so the cheapest and most expensive item
+    within a budget are found by bisection and the best ratio item
+    by walking the heap from the top (see best_ratio_item()).
+    Heap entries whose cost is out of date are skipped.
     """
     
-    def __init__(self, build_info = None, growth_factor = BUILD_GROWTH):
+    __slots__ = ("_build_growth", "_items", "_ids", "_costs", "_cps",
+                 "_by_cost", "_by_ratio", "_shared")
+    
+    def __init__(self, build_info = None, growth_factor = BUILD_GROWTH, 
+                 items = None):
         self._build_growth = growth_factor
         if build_info == None:
-            self._info = {"Cursor": [15.0, 0.1],
-                          "Grandma": [100.0, 0.5],
-                          "Farm": [500.0, 4.0],
-                          "Factory": [3000.0, 10.0],
-                          "Mine": [10000.0, 40.0],
-                          "Shipment": [40000.0, 100.0],
-                          "Alchemy Lab": [200000.0, 400.0],
-                          "Portal": [1666666.0, 6666.0],
-                          "Time Machine": [123456789.0, 98765.0],
-                          "Antimatter Condenser": [3999999999.0, 999999.0]}
-        else:
-            self._info = {}
-            for key, value in build_info.items():
-                self._info[key] = list(value)
-
-        self._items = sorted(self._info.keys())
+            build_info = DEFAULT_BUILD_INFO
+        if items == None:
+            items = self._default_items(build_info)
+        self._items = tuple(items)
+        self._ids = dict((item, item_id) 
+                         for item_id, item in enumerate(self._items))
+        self._costs = array.array("d", [build_info[item][0] 
+                                        for item in self._items])
+        self._cps = array.array("d", [build_info[item][1] 
+                                      for item in self._items])
+        self._by_cost = sorted((cost, item_id) 
+                               for item_id, cost in enumerate(self._costs))
+        self._build_ratio_heap()
+        self._shared = False
+    
+    def _default_items(self, build_info):
+        """
+        Item order used when none is given: sorted by name
+        """
+        return sorted(build_info.keys())
+    
+    def _build_ratio_heap(self):
+        """
+        Rebuild the cps/cost heap from the current costs
+        """
+        self._by_ratio = [(-(self._cps[item_id] / cost), item_id, cost)
+                          for item_id, cost in enumerate(self._costs)]
+        heapq.heapify(self._by_ratio)
             
     def build_items(self):
         """
@@ -40,25 +84,155 @@ class BuildInfo:
         Get the current cost of an item
         Will throw a KeyError exception if item is not in the build info.
         """
-        return self._info[item][0]
+        return self._costs[self._ids[item]]
     
     def get_cps(self, item):
         """
         Get the current CPS of an item
         Will throw a KeyError exception if item is not in the build info.
         """
-        return self._info[item][1]
+        return self._cps[self._ids[item]]
+    
+    def get_costs(self):
+        """
+        Get the current costs of all items, in build_items() order
+        """
+        return self._costs.tolist()
+    
+    def affordable_counts(self, budget):
+        """
+        Get how many of each item (in build_items() order) could be
+        bought back to back with budget cookies, from the closed form
+        cost * (growth ** count - 1) / (growth - 1) of their total cost.
+        A count is 0 exactly when the item costs more than budget.
+        
+        This is a plain loop rather than a NumPy expression: with a
+        dozen items, building the arrays costs more than the loop.
+        """
+        growth = self._build_growth
+        if growth != 1.0:
+            log_growth = math.log(growth)
+        counts = []
+        for cost in self._costs:
+            if cost > budget:
+                counts.append(0)
+                continue
+            if growth == 1.0:
+                counts.append(int(budget // cost))
+                continue
+            scale = cost / (growth - 1.0)
+            count = int(math.log(budget / scale + 1.0) / log_growth)
+            # Undo rounding errors of the logarithm
+            while scale * (growth ** (count + 1) - 1.0) <= budget:
+                count += 1
+            while count > 1 and scale * (growth ** count - 1.0) > budget:
+                count -= 1
+            counts.append(count)
+        return counts
+    
+    def get_item_id(self, item):
+        """
+        Get the id of an item (its index in build_items())
+        Will throw a KeyError exception if item is not in the build info.
+        """
+        return self._ids[item]
+    
+    def get_item_name(self, item_id):
+        """
+        Get the name of the item with the given id
+        """
+        return self._items[item_id]
     
-    def update_item(self, item):
+    def get_growth_factor(self):
+        """
+        Get the factor the cost of an item grows by on each purchase
+        """
+        return self._build_growth
+    
+    def update_item(self, item, count = 1):
         """
         Update the cost of an item by the growth factor
+        (count times, as if it was bought count times in a row)
         Will throw a KeyError exception if item is not in the build info.
         """
-        cost, cps = self._info[item]
-        self._info[item] = [cost * self._build_growth, cps]
+        item_id = self._ids[item]
+        if self._shared:
+            self._costs = self._costs[:]
+            self._by_cost = list(self._by_cost)
+            self._by_ratio = list(self._by_ratio)
+            self._shared = False
+        old_cost = self._costs[item_id]
+        cost = old_cost
+        for dummy_i in range(count):
+            cost = cost * self._build_growth
+        self._costs[item_id] = cost
+        
+        del self._by_cost[bisect.bisect_left(self._by_cost, 
+                                             (old_cost, item_id))]
+        bisect.insort(self._by_cost, (cost, item_id))
+        if len(self._by_ratio) >= 2 * len(self._items):
+            self._build_ratio_heap()
+        else:
+            heapq.heappush(self._by_ratio, 
+                           (-(self._cps[item_id] / cost), item_id, cost))
+    
+    def cheapest_item(self, budget):
+        """
+        Get the cheapest item that costs at most budget
+        (None if there is no such item)
+        """
+        if self._by_cost and self._by_cost[0][0] <= budget:
+            return self._items[self._by_cost[0][1]]
+        return None
+    
+    def most_expensive_item(self, budget):
+        """
+        Get the most expensive item that costs at most budget
+        (None if there is no such item)
+        """
+        index = bisect.bisect_right(self._by_cost, (budget, len(self._items)))
+        if index == 0:
+            return None
+        return self._items[self._by_cost[index - 1][1]]
+    
+    def best_ratio_item(self, budget):
+        """
+        Get the item with the highest cps/cost ratio among the items
+        that cost at most budget (None if there is no such item).
+        Ties go to the item that comes first in build_items().
+        
+        This is not a logarithmic query: the heap is walked best ratio
+        first, so the work grows with the number of better ratio items
+        that cost too much and of out of date entries passed on the
+        way (at most one per item before the heap is rebuilt).
+        """
+        # Walk the heap in order, best ratio first
+        heap = self._by_ratio
+        if not heap:
+            return None
+        frontier = [(heap[0], 0)]
+        while frontier:
+            entry, index = heapq.heappop(frontier)
+            dummy_ratio, item_id, cost = entry
+            if cost == self._costs[item_id] and cost <= budget:
+                return self._items[item_id]
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+        return None
         
     def clone(self):
         """
         Return a clone of this BuildInfo
         """
-        return BuildInfo(self._info, self._build_growth)
+        clone = type(self).__new__(type(self))
+        clone._build_growth = self._build_growth
+        clone._items = self._items
+        clone._ids = self._ids
+        clone._costs = self._costs
+        clone._cps = self._cps
+        clone._by_cost = self._by_cost
+        clone._by_ratio = self._by_ratio
+        clone._shared = True
+        self._shared = True
+        return clone
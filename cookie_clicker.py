@@ -2,72 +2,393 @@
 Cookie Clicker Simulator
 """
 
+import array
+import bisect
 import clicker 
 import math
-import simpleplot
+import os
+import shutil
+import simpletest
+import struct
+import tempfile
+import time
+import timeit
+
+# simpleplot only exists in CodeSkulptor; it is only needed for
+# plotting, so the simulator also runs without it
+try:
+    import simpleplot
+except ImportError:
+    simpleplot = None
 
 
 SIM_TIME = 10000000000.0
 
+# Longest run of back to back purchases made at once in fast mode
+RUN_LIMIT = 65536
+
+# History retention: keep every Nth purchase, or this many
+# purchases per tenfold increase of the time
+HISTORY_EVERY = 10
+HISTORY_PER_DECADE = 100
+
+# Points in the downsampled history used for plotting
+PLOT_POINTS = 1000
+
+# Binary history file: magic, then tagged records
+HISTORY_MAGIC = b"CCHIST01"
+NAME_RECORD = struct.Struct("<BHH")          # tag, item id, name length
+PURCHASE_RECORD = struct.Struct("<BdHdd")    # tag, time, item id, cost, total
+NAME_TAG = 0
+PURCHASE_TAG = 1
+
+# Wall clock seconds between checkpoints of simulate_clicker
+CHECKPOINT_SECONDS = 60.0
+
+# Checkpoint file: magic, then the game, build info and history.
+# The kept history entries go to an append-only log next to it
+# (path + CHECKPOINT_LOG_SUFFIX); the checkpoint only records how
+# many of them are valid, so a save writes just the new entries.
+CHECKPOINT_MAGIC = b"CCCKPT02"
+CHECKPOINT_LOG_SUFFIX = ".entries"
+CHECKPOINT_HEADER = struct.Struct("<dBB")    # duration, fast, finished
+STATE_RECORD = struct.Struct("<dddd")        # cookies, total, cps, time
+ITEM_RECORD = struct.Struct("<dd")           # cost, cps
+GROWTH_RECORD = struct.Struct("<d")
+LATEST_RECORD = struct.Struct("<ddd")        # time, cost, total
+RETENTION_RECORD = struct.Struct("<BQddQ")   # retention, every, ratio,
+                                             # next time, count
+ENTRY_RECORD = struct.Struct("<dHdd")        # time, item id, cost, total
+COUNT = struct.Struct("<Q")
+STRING_LENGTH = struct.Struct("<i")          # -1 for None
+RETENTIONS = ["full", "every", "log"]
+
+# Strategy latency histogram: bucket k counts calls that took less
+# than 2 ** k microseconds (the last bucket counts everything slower)
+HISTOGRAM_BUCKETS = 24
 
-BUILD_GROWTH = 1.15
 
-class BuildInfo:
+BUILD_GROWTH = clicker.BUILD_GROWTH
+
+DEFAULT_BUILD_INFO = clicker.DEFAULT_BUILD_INFO
+
+class BuildInfo(clicker.BuildInfo):
+    """
+    Class to track build information (see clicker.BuildInfo).
+    
+    Unless an item order is given, the items keep the order of the
+    build_info dictionary instead of being sorted by name.
+    """
+    
+    __slots__ = ()
+    
+    def _default_items(self, build_info):
+        """
+        Item order used when none is given
+        """
+        return build_info.keys()
+
+    
+class ClickerHistory:
     """
-    Class to track build information.
+    Purchase history stored column by column in typed arrays
+    (time, item id, cost, total cookies).
+    
+    retention is "full" (keep every purchase), "every" (keep every
+    Nth purchase) or "log" (keep about per_decade purchases per
+    tenfold increase of the time).  The latest purchase is always
+    available, whatever the retention.  If path is given, every
+    purchase is also streamed to that binary file.
     """
     
-    def __init__(self, build_info = None, growth_factor = BUILD_GROWTH):
-        self._build_growth = growth_factor
-        if build_info == None:
-            self._info = {"Cursor": [15.0, 0.1],
-                          "Grandma": [100.0, 0.5],
-                          "Farm": [500.0, 4.0],
-                          "Factory": [3000.0, 10.0],
-                          "Mine": [10000.0, 40.0],
-                          "Shipment": [40000.0, 100.0],
-                          "Alchemy Lab": [200000.0, 400.0],
-                          "Portal": [1666666.0, 6666.0],
-                          "Time Machine": [123456789.0, 98765.0],
-                          "Antimatter Condenser": [3999999999.0, 999999.0]}
+    def __init__(self, retention = "full", every = HISTORY_EVERY, 
+                 per_decade = HISTORY_PER_DECADE, path = None):
+        if retention not in ("full", "every", "log"):
+            raise ValueError("unknown retention: " + str(retention))
+        self._retention = retention
+        self._every = every
+        self._ratio = 10.0 ** (1.0 / per_decade)
+        self._next_time = 0.0
+        self._count = 0
+        self._latest = None
+        self._item_names = [None]       # item id 0 is "no item"
+        self._item_ids = {None: 0}
+        self._times = array.array("d")
+        self._items = array.array("H")
+        self._costs = array.array("d")
+        self._totals = array.array("d")
+        self._saved = 0                 # kept entries in the checkpoint log
+        self._entries = []              # kept entries listed so far
+        self._listed_latest = False     # whether _entries ends in _latest
+        self._file = None
+        if path is not None:
+            self._file = open(path, "wb")
+            self._file.write(HISTORY_MAGIC)
+        self._select_add()
+    
+    def _select_add(self):
+        """
+        Choose add() for the retention once, instead of on every
+        purchase: "full" keeps every entry without any test
+        """
+        if self._retention == "full":
+            self.add = self._add_full
+            self._append_time = self._times.append
+            self._append_item = self._items.append
+            self._append_cost = self._costs.append
+            self._append_total = self._totals.append
         else:
-            self._info = {}
-            for key, value in build_info.items():
-                self._info[key] = list(value)
-            
-    def build_items(self):
+            # The class add() tests the retention on every entry
+            self.__dict__.pop("add", None)
+    
+    def _item_id(self, item_name):
         """
-        Get a list of buildable items
+        Return the id of an item name, numbering new names
+        (and writing them to the file) as they show up
         """
-        return self._info.keys()
-            
-    def get_cost(self, item):
+        item_id = self._item_ids.get(item_name)
+        if item_id is None:
+            item_id = len(self._item_names)
+            self._item_names.append(item_name)
+            self._item_ids[item_name] = item_id
+            if self._file is not None:
+                name = item_name.encode("utf-8")
+                self._file.write(NAME_RECORD.pack(NAME_TAG, item_id, 
+                                                  len(name)) + name)
+        return item_id
+    
+    def _add_full(self, time, item_name, cost, total_cookies):
         """
-        Get the current cost of an item
-        Will throw a KeyError exception if item is not in the build info.
+        add() for the "full" retention
         """
-        return self._info[item][0]
+        item_id = self._item_ids.get(item_name)
+        if item_id is None:
+            item_id = self._item_id(item_name)
+        if self._file is not None:
+            self._file.write(PURCHASE_RECORD.pack(PURCHASE_TAG, time, item_id, 
+                                                  cost, total_cookies))
+        self._count += 1
+        self._append_time(time)
+        self._append_item(item_id)
+        self._append_cost(cost)
+        self._append_total(total_cookies)
     
-    def get_cps(self, item):
+    def add(self, time, item_name, cost, total_cookies):
         """
-        Get the current CPS of an item
-        Will throw a KeyError exception if item is not in the build info.
+        Add an entry (time, item, cost of item, total cookies)
         """
-        return self._info[item][1]
+        item_id = self._item_id(item_name)
+        if self._file is not None:
+            self._file.write(PURCHASE_RECORD.pack(PURCHASE_TAG, time, item_id, 
+                                                  cost, total_cookies))
+        if self._retention == "full":
+            keep = True
+        elif self._retention == "every":
+            keep = self._count % self._every == 0
+        else:
+            keep = time >= self._next_time
+            if keep:
+                self._next_time = max(time * self._ratio, time + 1.0)
+        self._count += 1
+        if keep:
+            self._times.append(time)
+            self._items.append(item_id)
+            self._costs.append(cost)
+            self._totals.append(total_cookies)
+            self._latest = None
+        else:
+            self._latest = (time, item_name, cost, total_cookies)
     
-    def update_item(self, item):
+    def get_count(self):
         """
-        Update the cost of an item by the growth factor
-        Will throw a KeyError exception if item is not in the build info.
+        Return the number of entries added, kept or not
+        """
+        return self._count
+    
+    def get_entries(self):
+        """
+        Return the kept entries (and the latest one) as a list of
+        tuples (time, item, cost of item, total cookies).  The same
+        list is extended with the new entries on every call.
+        """
+        entries = self._entries
+        if self._listed_latest:
+            entries.pop()
+        names = self._item_names
+        times = self._times
+        items = self._items
+        costs = self._costs
+        totals = self._totals
+        for index in range(len(entries), len(times)):
+            entries.append((times[index], names[items[index]], costs[index], 
+                            totals[index]))
+        self._listed_latest = self._latest is not None
+        if self._listed_latest:
+            entries.append(self._latest)
+        return entries
+    
+    def plot_points(self, threshold = PLOT_POINTS):
+        """
+        Return at most threshold (time, total cookies) points for
+        plotting, downsampled with downsample_lttb()
+        """
+        points = list(zip(self._times, self._totals))
+        if self._latest is not None:
+            points.append((self._latest[0], self._latest[3]))
+        return downsample_lttb(points, threshold)
+    
+    def close(self):
+        """
+        Flush and close the history file, if any
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def save_state(self, out, log_path):
         """
-        cost, cps = self._info[item]
-        self._info[item] = [cost * self._build_growth, cps]
+        Write the retention settings, item names, latest entry and
+        history file cursor to the checkpoint stream out, and append
+        the entries kept since the last save to the log at log_path.
+        Only the new entries are written, whatever the history size.
+        """
+        out.write(RETENTION_RECORD.pack(
+            RETENTIONS.index(self._retention), self._every, 
+            self._ratio, self._next_time, self._count))
+        out.write(COUNT.pack(len(self._item_names) - 1))
+        for name in self._item_names[1:]:
+            _write_string(out, name)
+        if self._latest is None:
+            out.write(COUNT.pack(0))
+        else:
+            entry_time, item, cost, total = self._latest
+            out.write(COUNT.pack(1))
+            out.write(LATEST_RECORD.pack(entry_time, cost, total))
+            _write_string(out, item)
+        if self._file is None:
+            _write_string(out, None)
+            out.write(COUNT.pack(0))
+        else:
+            self._file.flush()
+            _write_string(out, os.path.abspath(self._file.name))
+            out.write(COUNT.pack(self._file.tell()))
         
-    def clone(self):
+        # Drop whatever a crash after the last save left behind,
+        # then append the new entries
+        with open(log_path, "r+b" if os.path.exists(log_path) else "wb") \
+                as log:
+            log.truncate(self._saved * ENTRY_RECORD.size)
+            log.seek(0, os.SEEK_END)
+            pack = ENTRY_RECORD.pack
+            log.write(b"".join(pack(self._times[index], self._items[index], 
+                                    self._costs[index], self._totals[index])
+                               for index in range(self._saved, 
+                                                  len(self._times))))
+            log.flush()
+            os.fsync(log.fileno())
+        self._saved = len(self._times)
+        out.write(COUNT.pack(self._saved))
+    
+    def load_state(self, stream, log_path):
         """
-        Return a clone of this BuildInfo
+        Restore a history written by save_state() from the checkpoint
+        stream and the log at log_path.  Log entries past the saved
+        count are dropped and the history file, if any, is reopened
+        at the saved cursor.
         """
-        return BuildInfo(self._info, self._build_growth)
+        retention, self._every, self._ratio, self._next_time, \
+            self._count = _read_record(stream, RETENTION_RECORD)
+        self._retention = RETENTIONS[retention]
+        self._select_add()
+        for dummy_i in range(_read_record(stream, COUNT)[0]):
+            name = _read_string(stream)
+            self._item_ids[name] = len(self._item_names)
+            self._item_names.append(name)
+        if _read_record(stream, COUNT)[0]:
+            entry_time, cost, total = _read_record(stream, LATEST_RECORD)
+            self._latest = (entry_time, _read_string(stream), cost, total)
+        history_path = _read_string(stream)
+        cursor = _read_record(stream, COUNT)[0]
+        self._saved = _read_record(stream, COUNT)[0]
+        
+        with open(log_path, "r+b") as log:
+            data = log.read(self._saved * ENTRY_RECORD.size)
+            if len(data) != self._saved * ENTRY_RECORD.size:
+                raise ValueError("checkpoint log is too short: " + log_path)
+            log.truncate(len(data))
+        for offset in range(0, len(data), ENTRY_RECORD.size):
+            entry_time, item_id, cost, total = ENTRY_RECORD.unpack_from(
+                data, offset)
+            self._times.append(entry_time)
+            self._items.append(item_id)
+            self._costs.append(cost)
+            self._totals.append(total)
+        
+        if history_path is not None:
+            self._file = open(history_path, "r+b")
+            self._file.truncate(cursor)
+            self._file.seek(cursor)
+
+
+def read_history(path):
+    """
+    Generator that yields every (time, item, cost of item, total
+    cookies) entry of a history file written by ClickerHistory.
+    """
+    with open(path, "rb") as history_file:
+        if history_file.read(len(HISTORY_MAGIC)) != HISTORY_MAGIC:
+            raise ValueError("not a cookie clicker history file: " + path)
+        names = [None]
+        while True:
+            tag = history_file.read(1)
+            if not tag:
+                return
+            if ord(tag) == NAME_TAG:
+                dummy_tag, dummy_id, length = NAME_RECORD.unpack(
+                    tag + history_file.read(NAME_RECORD.size - 1))
+                names.append(history_file.read(length).decode("utf-8"))
+            else:
+                dummy_tag, time, item_id, cost, total = PURCHASE_RECORD.unpack(
+                    tag + history_file.read(PURCHASE_RECORD.size - 1))
+                yield time, names[item_id], cost, total
+
+
+def downsample_lttb(points, threshold):
+    """
+    Reduce a list of (x, y) points sorted by x to threshold points
+    with the Largest-Triangle-Three-Buckets algorithm, which keeps
+    the peaks and bends of the curve.  The first and last points
+    are always kept.
+    """
+    if threshold >= len(points) or threshold < 3:
+        return list(points)
+    sampled = [points[0]]
+    bucket_size = (len(points) - 2) / float(threshold - 2)
+    previous = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+        
+        # Average of the next bucket (the last point for the last one)
+        next_end = min(int((bucket + 2) * bucket_size) + 1, len(points))
+        next_points = points[end:next_end] or points[-1:]
+        avg_x = sum(point[0] for point in next_points) / len(next_points)
+        avg_y = sum(point[1] for point in next_points) / len(next_points)
+        
+        # Keep the point that makes the largest triangle with the
+        # previous kept point and the average of the next bucket
+        prev_x, prev_y = points[previous]
+        best_area = -1.0
+        for index in range(start, end):
+            point_x, point_y = points[index]
+            area = abs((prev_x - avg_x) * (point_y - prev_y) - 
+                       (prev_x - point_x) * (avg_y - prev_y))
+            if area > best_area:
+                best_area = area
+                previous = index
+        sampled.append(points[previous])
+    sampled.append(points[-1])
+    return sampled
 
     
 class ClickerState:
@@ -75,12 +396,15 @@ class ClickerState:
     Simple class to keep track of the game state.
     """
     
-    def __init__(self):
+    def __init__(self, history = None):
         self._cookies_ = 0.0          # should be a float
         self._total_cookies_ = 0.0    # total cookies earned so far
         self._cps_ = 1.0              
         self._current_time_ = 0.0     
-        self._history_ = [(0.0, None, 0.0, 0.0)]  
+        if history is None:
+            history = ClickerHistory()
+        self._history_ = history
+        self._history_.add(0.0, None, 0.0, 0.0)
         
     def __str__(self):
         """
@@ -102,6 +426,14 @@ class ClickerState:
         """
         return self._cookies_ 
     
+    def get_total_cookies(self):
+        """
+        Return total number of cookies earned so far
+        
+        Should return a float
+        """
+        return self._total_cookies_ 
+    
     def get_cps(self):
         """
         Get current CPS
@@ -123,7 +455,23 @@ class ClickerState:
         (time, item, cost of item, total cookies)
         For example: (0.0, None, 0.0, 0.0)
         """
-        return self._history_ 
+        return self._history_.get_entries()
+    
+    def get_history_store(self):
+        """
+        Return the ClickerHistory behind get_history()
+        """
+        return self._history_
+    
+    def restore(self, cookies, total_cookies, cps, time, history):
+        """
+        Replace the whole state, e.g. with one read from a checkpoint
+        """
+        self._cookies_ = cookies
+        self._total_cookies_ = total_cookies
+        self._cps_ = cps
+        self._current_time_ = time
+        self._history_ = history
 
     def time_until(self, cookies):
         """
@@ -136,6 +484,19 @@ class ClickerState:
         else:
             return math.ceil((cookies - self._cookies_)/self._cps_) 
     
+    def affordability(self, build_info, time_left):
+        """
+        Return (waits, counts) for all items of build_info, in
+        build_items() order: the time until each one is affordable
+        (as time_until() would return) and how many of each could be
+        bought back to back by the end of time_left at the current CPS
+        """
+        cookies = self._cookies_
+        cps = self._cps_
+        waits = [0.0 if cookies >= cost else math.ceil((cost - cookies) / cps)
+                 for cost in build_info.get_costs()]
+        return waits, build_info.affordable_counts(cookies + cps * time_left)
+    
     def wait(self, time):
         """
         Wait for given amount of time and update state
@@ -156,25 +517,205 @@ class ClickerState:
         if self._cookies_ >= cost:
             self._cookies_ -= cost
             self._cps_ += additional_cps
-            self._history_.append( (self._current_time_, item_name, cost, self._total_cookies_) )
+            self._history_.add(self._current_time_, item_name, cost, self._total_cookies_)
         else:
             return
+    
+    def buy_repeatedly(self, item_name, cost, additional_cps, growth, 
+                       duration, keeps, limit = RUN_LIMIT):
+        """
+        Buy copies of an item back to back, multiplying its cost by
+        growth after every purchase, for as long as
+        keeps(budget, cost) says the strategy would pick the item
+        again and it can be bought before the duration (at most
+        limit copies).  The caller has checked the first purchase.
+        Same result as rounds of time_until, wait and buy_item.
+        Returns the number of copies bought.
+        """
+        cookies = self._cookies_
+        total = self._total_cookies_
+        cps = self._cps_
+        now = self._current_time_
+        add_entry = self._history_.add
+        count = 0
+        while True:
+            if cookies < cost:
+                time = math.ceil((cost - cookies) / cps)
+                cookies = cookies + time * cps
+                total = total + time * cps
+                now += time
+            if cookies >= cost:
+                cookies -= cost
+                cps += additional_cps
+                add_entry(now, item_name, cost, total)
+            cost = cost * growth
+            count += 1
+            
+            # Stop where the game loop would stop buying the item
+            time_left = duration - now
+            if count == limit or time_left < 0 or \
+               not keeps(cookies + cps * time_left, cost) or \
+               (cookies < cost and math.ceil((cost - cookies) / cps) > time_left):
+                break
+        self._cookies_ = cookies
+        self._total_cookies_ = total
+        self._cps_ = cps
+        self._current_time_ = now
+        return count
 
         
-def simulate_clicker(build_info, duration, strategy):
+class ClickerProfiler:
+    """
+    Collects timings of a simulate_clicker() game: calls and
+    cumulative seconds per phase, a histogram of strategy latency
+    and, with sample_every = N, every Nth strategy decision.
+    In fast mode the purchases made without asking the strategy are
+    timed as the "buy_repeatedly" phase.
+    """
+    
+    def __init__(self, sample_every = 0):
+        self._sample_every = sample_every
+        self._phases = {}
+        self._histogram = [0] * HISTOGRAM_BUCKETS
+        self._decisions = 0
+        self._samples = []
+    
+    def timed(self, phase, function):
+        """
+        Return function wrapped to count and time its calls
+        under the given phase
+        """
+        stats = self._phases.setdefault(phase, [0, 0.0])
+        timer = timeit.default_timer
+        
+        def timed_function(*args, **kwargs):
+            """
+            Time one call
+            """
+            start = timer()
+            result = function(*args, **kwargs)
+            stats[0] += 1
+            stats[1] += timer() - start
+            return result
+        return timed_function
+    
+    def wrap_strategy(self, strategy):
+        """
+        Return the strategy wrapped to time its calls, fill the
+        latency histogram and sample decisions
+        """
+        stats = self._phases.setdefault("strategy", [0, 0.0])
+        histogram = self._histogram
+        last_bucket = HISTOGRAM_BUCKETS - 1
+        timer = timeit.default_timer
+        
+        def timed_strategy(cookies, cps, time_left, build_info):
+            """
+            Time one decision
+            """
+            start = timer()
+            item = strategy(cookies, cps, time_left, build_info)
+            latency = timer() - start
+            stats[0] += 1
+            stats[1] += latency
+            bucket = int(latency * 1e6).bit_length()
+            histogram[min(bucket, last_bucket)] += 1
+            self._decisions += 1
+            if self._sample_every and \
+               self._decisions % self._sample_every == 0:
+                self._samples.append((cookies, cps, time_left, item, 
+                                      latency))
+            return item
+        return timed_strategy
+    
+    def report(self):
+        """
+        Return the collected timings as a dictionary:
+        "phases" maps each phase to its "calls" and "seconds",
+        "strategy_histogram" lists (upper bound in seconds, calls),
+        "decisions" counts strategy calls and "samples" holds
+        (cookies, cps, time left, item, seconds) per sampled decision
+        """
+        phases = {}
+        for phase, (calls, seconds) in self._phases.items():
+            phases[phase] = {"calls": calls, "seconds": seconds}
+        return {"phases": phases,
+                "strategy_histogram": [(2 ** bucket * 1e-6, count) 
+                                       for bucket, count 
+                                       in enumerate(self._histogram)],
+                "decisions": self._decisions,
+                "samples": list(self._samples)}
+
+
+def simulate_clicker(build_info, duration, strategy, fast = False, 
+                     history = None, checkpoint = None, 
+                     checkpoint_every = CHECKPOINT_SECONDS, profiler = None):
     """
     Function to run a Cookie Clicker game for the given
     duration with the given strategy.  Returns a ClickerState
-    object corresponding to game.
+    object corresponding to game.  The purchases are recorded
+    in history (a ClickerHistory, full retention by default).
+    
+    With fast = True and one of the strategies in RUN_RULES, once the
+    strategy picks the same item twice in a row the following
+    purchases of it are made without calling the strategy or updating
+    build_info for each of them: the strategy's rule tells, from the
+    budget and the next cost of the item, whether it would pick the
+    item again, so the result is exactly the same.  Other strategies
+    are asked before every purchase, as without fast.
+    
+    With checkpoint set to a path, the game is saved there every
+    checkpoint_every seconds of wall time and after the last
+    purchase; resume_simulation() continues it from there.
+    
+    A ClickerProfiler passed as profiler times the strategy and the
+    bookkeeping phases of the game; without one nothing is timed.
     """
-    click_object = ClickerState()           # create a click state object
+    click_object = ClickerState(history)    # create a click state object
     build_info_object = build_info.clone()  # create a clone of build_info
+    return play_clicker(click_object, build_info_object, duration, strategy,
+                        fast, checkpoint, checkpoint_every, profiler)
+
+
+def play_clicker(click_object, build_info_object, duration, strategy, 
+                 fast = False, checkpoint = None, 
+                 checkpoint_every = CHECKPOINT_SECONDS, profiler = None):
+    """
+    Play a game from the given state until the duration has passed
+    (see simulate_clicker()).  Returns click_object.
+    """
+    last_checkpoint = time.time()
+    rule = None
+    if fast:
+        rule = RUN_RULES.get(strategy)
+    last_item = None
+    
+    # Bound once up front, so that a profiler can swap in timed
+    # versions and an unprofiled game pays nothing for it
+    time_until = click_object.time_until
+    wait = click_object.wait
+    buy_item = click_object.buy_item
+    buy_repeatedly = click_object.buy_repeatedly
+    update_item = build_info_object.update_item
+    save = save_checkpoint
+    if profiler is not None:
+        strategy = profiler.wrap_strategy(strategy)
+        time_until = profiler.timed("time_until", time_until)
+        wait = profiler.timed("wait", wait)
+        buy_item = profiler.timed("buy_item", buy_item)
+        buy_repeatedly = profiler.timed("buy_repeatedly", buy_repeatedly)
+        update_item = profiler.timed("update_item", update_item)
+        save = profiler.timed("checkpoint", save)
 
    
     # 1:
     # Check the current time and break out of the loop 
     # if the duration has been passed
     while click_object.get_time() <= duration:
+        if checkpoint is not None and \
+           time.time() - last_checkpoint >= checkpoint_every:
+            save(checkpoint, click_object, build_info_object, duration, fast)
+            last_checkpoint = time.time()
        
         # 2:
         # Call the strategy function with the appropriate arguments to determine 
@@ -195,20 +736,40 @@ def simulate_clicker(build_info, duration, strategy):
         # 4:
         # Wait until that time.
         cost = build_info_object.get_cost(item)
-        time_to_wait = click_object.time_until(cost)    # only wait to integer
+        time_to_wait = time_until(cost)    # only wait to integer
         if time_left < time_to_wait:
             break
+        elif rule is not None and item == last_item:
+            # The strategy picked the item twice in a row: follow
+            # its rule until it would pick something else
+            count = buy_repeatedly(item, cost, build_info_object.get_cps(item),
+                                   build_info_object.get_growth_factor(),
+                                   duration, rule(build_info_object, item))
+            update_item(item, count)
+            continue
         else:
-            click_object.wait(time_to_wait)
+            wait(time_to_wait)
 
         # 5.
         # Buy the item
-        click_object.buy_item(item, cost, build_info_object.get_cps(item) )
+        buy_item(item, cost, build_info_object.get_cps(item) )
         
         # 6.
         # Update the build information.
-        build_info_object.update_item(item)
+        update_item(item)
+        last_item = item
     
+    if checkpoint is not None:
+        save(checkpoint, click_object, build_info_object, duration, fast,
+             finished = True)
+    return finish_clicker(click_object, duration)
+
+
+def finish_clicker(click_object, duration):
+    """
+    Wait out the time left after the last purchase.
+    Returns click_object.
+    """
     # Wait the amount of time left:
     time_left = duration - click_object.get_time()
     if time_left > 0:
@@ -218,6 +779,128 @@ def simulate_clicker(build_info, duration, strategy):
     return click_object          
 
 
+def _write_string(out, text):
+    """
+    Write a string (or None) to a checkpoint file
+    """
+    if text is None:
+        out.write(STRING_LENGTH.pack(-1))
+    else:
+        data = text.encode("utf-8")
+        out.write(STRING_LENGTH.pack(len(data)) + data)
+
+
+def _read_string(stream):
+    """
+    Read a string (or None) written by _write_string()
+    """
+    length = STRING_LENGTH.unpack(stream.read(STRING_LENGTH.size))[0]
+    if length < 0:
+        return None
+    data = stream.read(length)
+    if isinstance(data, str):
+        # Python 2: keep the native string type of the names
+        return data
+    return data.decode("utf-8")
+
+
+def _read_record(stream, record):
+    """
+    Read and unpack one struct record
+    """
+    return record.unpack(stream.read(record.size))
+
+
+# BuildInfo classes a checkpoint may name, by module
+CHECKPOINT_BUILD_INFOS = {"clicker": clicker.BuildInfo, 
+                          "cookie_clicker": BuildInfo}
+
+
+def save_checkpoint(path, click_object, build_info, duration, fast, 
+                    finished = False):
+    """
+    Save a game in progress (state, build info and history) to a
+    checkpoint file.  The file is renamed into place, so a crash 
+    while saving leaves the previous checkpoint intact; the history
+    entries go to the log next to it (see ClickerHistory.save_state()).
+    """
+    for module, build_info_class in CHECKPOINT_BUILD_INFOS.items():
+        if type(build_info) is build_info_class:
+            break
+    else:
+        raise ValueError("cannot checkpoint a " + type(build_info).__name__)
+    
+    out = tempfile.NamedTemporaryFile(dir = os.path.dirname(path) or ".", 
+                                      suffix = ".tmp", delete = False)
+    with out:
+        out.write(CHECKPOINT_MAGIC)
+        out.write(CHECKPOINT_HEADER.pack(duration, fast, finished))
+        out.write(STATE_RECORD.pack(click_object.get_cookies(), 
+                                    click_object.get_total_cookies(), 
+                                    click_object.get_cps(), 
+                                    click_object.get_time()))
+        
+        _write_string(out, module)
+        out.write(GROWTH_RECORD.pack(build_info.get_growth_factor()))
+        items = build_info.build_items()
+        out.write(COUNT.pack(len(items)))
+        for item in items:
+            _write_string(out, item)
+            out.write(ITEM_RECORD.pack(build_info.get_cost(item), 
+                                       build_info.get_cps(item)))
+        
+        click_object.get_history_store().save_state(
+            out, path + CHECKPOINT_LOG_SUFFIX)
+    os.rename(out.name, path)
+
+
+def load_checkpoint(path):
+    """
+    Read a checkpoint written by save_checkpoint().  Returns
+    (click_object, build_info, duration, fast, finished).
+    """
+    with open(path, "rb") as stream:
+        if stream.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+            raise ValueError("not a cookie clicker checkpoint: " + path)
+        duration, fast, finished = _read_record(stream, CHECKPOINT_HEADER)
+        cookies, total, cps, now = _read_record(stream, STATE_RECORD)
+        
+        module = _read_string(stream)
+        if module not in CHECKPOINT_BUILD_INFOS:
+            raise ValueError("unknown build info module: " + str(module))
+        growth = _read_record(stream, GROWTH_RECORD)[0]
+        items = []
+        info = {}
+        for dummy_i in range(_read_record(stream, COUNT)[0]):
+            item = _read_string(stream)
+            items.append(item)
+            info[item] = list(_read_record(stream, ITEM_RECORD))
+        build_info = CHECKPOINT_BUILD_INFOS[module](info, growth, items)
+        
+        history = ClickerHistory()
+        history.load_state(stream, path + CHECKPOINT_LOG_SUFFIX)
+    
+    click_object = ClickerState()
+    click_object.restore(cookies, total, cps, now, history)
+    return click_object, build_info, duration, bool(fast), bool(finished)
+
+
+def resume_simulation(path, strategy, checkpoint_every = CHECKPOINT_SECONDS,
+                      profiler = None):
+    """
+    Continue the game saved in the checkpoint file path with the 
+    strategy it was started with, checkpointing to the same file.
+    Returns the final ClickerState, exactly as an uninterrupted
+    simulate_clicker() would have.
+    """
+    click_object, build_info, duration, fast, finished = \
+        load_checkpoint(path)
+    if finished:
+        return finish_clicker(click_object, duration)
+    return play_clicker(click_object, build_info, duration, strategy, fast,
+                        path, checkpoint_every, profiler)
+
+
 def strategy_cursor_broken(cookies, cps, time_left, build_info):
     """
     Always pick Cursor!
@@ -232,7 +915,7 @@ def strategy_cursor_broken(cookies, cps, time_left, build_info):
     return "Cursor"
 
 
-def strategy_none(cookies, cps, history, time_left, build_info):
+def strategy_none(cookies, cps, time_left, build_info):
     """
     Always return None
 
@@ -240,34 +923,20 @@ def strategy_none(cookies, cps, history, time_left, build_info):
     that you can use to help debug your simulate_clicker function.
     """
     return None
-    
-def map_costs_to_items():
-    available_items = build_info.build_items()
-    item_costs = {}
-    for item in available_items:
-        cost = build_info.get_cost(item)
-        item_costs[cost] = item
-        costs.append(cost)
-    return item_costs
 
-def strategy_cheap(cookies, cps, history, time_left, build_info):
+
+def strategy_cheap(cookies, cps, time_left, build_info):
     """
     Always buy the cheapest item you can afford in the time left.
     """
-    future_cookies = cookies + cps * time_left
-    costs_map = map_costs_to_items()
-    return costs_mapping[min(filter(lambda x: x <= future_cookies, 
-                                    costs_map.keys()))]
+    return build_info.cheapest_item(cookies + cps * time_left)
 
 
-def strategy_expensive(cookies, cps, history, time_left, build_info):
+def strategy_expensive(cookies, cps, time_left, build_info):
     """
     Always buy the most expensive item you can afford in the time left.
     """
-    future_cookies = cookies + cps * time_left
-    costs_map = map_costs_to_items()
-    return costs_mapping[max(filter(lambda x: x <= future_cookies, 
-                                    costs_map.keys()))]
+    return build_info.most_expensive_item(cookies + cps * time_left)
 
 
 def strategy_best(cookies, cps, time_left, build_info):
@@ -282,29 +951,102 @@ def strategy_best_cps_cost_ratio( cookies, cps, time_left, build_info):
     """
     From the affordable item list, choose the one with the best cps/cost ratio
     """
-    end_cookies = cookies + cps * time_left
-    item_list = build_info.build_items()
-
-    best_ratio_item = None
-    best_ratio = 0.0
-    for item in item_list:
-        if build_info.get_cost( item ) > end_cookies:
-            continue
-       
-        # if no item has been choosed, choose this one 
-        if best_ratio_item == None:
-            best_ratio_item = item
-            best_ratio = build_info.get_cps( item )/ build_info.get_cost( item)
-            continue
+    return build_info.best_ratio_item(cookies + cps * time_left)
         
-        curr_ratio = build_info.get_cps(item)/build_info.get_cost(item)
 
-        if  curr_ratio > best_ratio: 
-            best_ratio = curr_ratio
-            best_ratio_item = item
+def _other_items(build_info, item):
+    """
+    Return the id of an item and a list of (cost, id, cps) of
+    all the other items, sorted by cost
+    """
+    item_id = build_info.get_item_id(item)
+    others = [(cost, other_id, build_info.get_cps(
+                   build_info.get_item_name(other_id)))
+              for other_id, cost in enumerate(build_info.get_costs())
+              if other_id != item_id]
+    others.sort()
+    return item_id, others
+
+
+def rule_always(dummy_build_info, dummy_item):
+    """
+    Run rule of strategy_cursor_broken: it always picks its item
+    """
+    return lambda budget, cost: True
+
+
+def rule_cheap(build_info, item):
+    """
+    Run rule of strategy_cheap: it picks the item again while the
+    item is affordable and still the cheapest one
+    """
+    item_id, others = _other_items(build_info, item)
+    if not others:
+        return lambda budget, cost: cost <= budget
+    cheapest = others[0][:2]
+    return lambda budget, cost: cost <= budget and (cost, item_id) < cheapest
+
+
+def rule_expensive(build_info, item):
+    """
+    Run rule of strategy_expensive: it picks the item again while
+    the item is affordable and no other affordable item costs more
+    """
+    item_id, others = _other_items(build_info, item)
+    others = [other[:2] for other in others]
+    limit = len(build_info.build_items())
+    
+    def keeps(budget, cost):
+        """
+        Whether the strategy picks the item at this budget and cost
+        """
+        if cost > budget:
+            return False
+        index = bisect.bisect_right(others, (budget, limit))
+        return index == 0 or others[index - 1] < (cost, item_id)
+    return keeps
+
+
+def rule_best(build_info, item):
+    """
+    Run rule of strategy_best: it picks the item again while the
+    item is affordable and no other affordable item has a better
+    cps/cost ratio (ties go to the lower item id)
+    """
+    item_id, others = _other_items(build_info, item)
+    additional_cps = build_info.get_cps(item)
+    costs = [other[0] for other in others]
+    
+    # Best (-ratio, id) among the others up to each cost
+    best_keys = []
+    for cost, other_id, cps in others:
+        key = (-(cps / cost), other_id)
+        if best_keys and best_keys[-1] < key:
+            key = best_keys[-1]
+        best_keys.append(key)
+    
+    def keeps(budget, cost):
+        """
+        Whether the strategy picks the item at this budget and cost
+        """
+        if cost > budget:
+            return False
+        index = bisect.bisect_right(costs, budget)
+        return index == 0 or (-(additional_cps / cost), item_id) < \
+            best_keys[index - 1]
+    return keeps
+
+
+# Strategies whose choices fast mode can follow without calling them:
+# strategy -> rule(build_info, item), which returns keeps(budget, cost)
+# telling whether the strategy would pick the item again when nothing
+# but the cost of that item has changed
+RUN_RULES = {strategy_cursor_broken: rule_always,
+             strategy_cheap: rule_cheap,
+             strategy_expensive: rule_expensive,
+             strategy_best: rule_best,
+             strategy_best_cps_cost_ratio: rule_best}
 
-    return best_ratio_item
-        
 
 def run_strategy(strategy_name, time, strategy):
     """
@@ -318,8 +1060,7 @@ def run_strategy(strategy_name, time, strategy):
     # Uncomment out the lines below to see a plot of total cookies vs. time
     # Be sure to allow popups, if you do want to see it
 
-    # history = state.get_history()
-    # history = [(item[0], item[3]) for item in history]
+    # history = state.get_history_store().plot_points()
     # simpleplot.plot_lines(strategy_name, 1000, 400, 'Time', 'Total Cookies', [history], True)
 
 
@@ -333,7 +1074,236 @@ def run():
     # run_strategy("Cheap", SIM_TIME, strategy_cheap)
     # run_strategy("Expensive", SIM_TIME, strategy_expensive)
     # run_strategy("Best", SIM_TIME, strategy_best)
+
+
+def run_test_suite():
+    """
+    Some informal tests
+    """
+    suite = simpletest.TestSuite()
+    
+    # Strategies pick from the items affordable in the time left
+    info = BuildInfo({"A": [10.0, 1.0], "B": [20.0, 4.0], 
+                      "C": [40.0, 4.0]}, 1.15, ["A", "B", "C"])
+    suite.run_test(strategy_cheap(5.0, 1.0, 10.0, info), "A", "Test #1:")
+    suite.run_test(strategy_cheap(5.0, 1.0, 0.0, info), None, "Test #2:")
+    suite.run_test(strategy_expensive(5.0, 1.0, 20.0, info), "B", "Test #3:")
+    suite.run_test(strategy_expensive(0.0, 1.0, 100.0, info), "C", 
+                   "Test #4:")
+    suite.run_test(strategy_best(0.0, 1.0, 100.0, info), "B", "Test #5:")
+    suite.run_test(strategy_best(0.0, 1.0, 15.0, info), "A", "Test #6:")
+    # B now costs 20 * 1.15 ** 5 = 40.2; A and C tie on ratio 0.1
+    info.update_item("B", 5)
+    suite.run_test(strategy_cheap(0.0, 1.0, 100.0, info), "A", "Test #7:")
+    suite.run_test(strategy_expensive(0.0, 1.0, 40.1, info), "C", 
+                   "Test #8:")
+    suite.run_test(strategy_best(0.0, 1.0, 100.0, info), "A", "Test #9:")
+    
+    # No items: every strategy gives up
+    empty = BuildInfo({})
+    suite.run_test([strategy_cheap(0.0, 1.0, 1e9, empty), 
+                    strategy_expensive(0.0, 1.0, 1e9, empty), 
+                    strategy_best(0.0, 1.0, 1e9, empty)], 
+                   [None, None, None], "Test #10:")
+    
+    # Index queries, with budgets equal to costs and cost ties
+    # (B and C both cost 20: the cheapest is B, the most expensive C)
+    info = BuildInfo({"A": [10.0, 1.0], "B": [20.0, 4.0], "C": [20.0, 2.0],
+                      "D": [40.0, 4.0]}, 1.15, ["A", "B", "C", "D"])
+    suite.run_test([info.cheapest_item(9.99), info.cheapest_item(10.0)], 
+                   [None, "A"], "Test #11:")
+    suite.run_test([info.most_expensive_item(9.99), 
+                    info.most_expensive_item(19.99), 
+                    info.most_expensive_item(20.0), 
+                    info.most_expensive_item(40.0)], 
+                   [None, "A", "C", "D"], "Test #12:")
+    # A now costs 20.11 and D in the clone 46
+    info.update_item("A", 5)
+    clone = info.clone()
+    clone.update_item("D")
+    suite.run_test([info.cheapest_item(20.0), info.most_expensive_item(20.5),
+                    info.most_expensive_item(40.0)], 
+                   ["B", "A", "D"], "Test #13:")
+    suite.run_test([clone.cheapest_item(20.0), clone.most_expensive_item(40.0),
+                    clone.most_expensive_item(46.0)], 
+                   ["B", "A", "D"], "Test #14:")
+    info.update_item("B", 2)
+    info.update_item("C", 2)
+    suite.run_test([info.cheapest_item(20.2), info.cheapest_item(20.0)], 
+                   ["A", None], "Test #15:")
+    
+    # Closed form counts: 10 + 11.5 + ... + 17.5 = 87.5 <= 100 (6 A),
+    # 20 + 23 + 26.45 + 30.4 = 99.9 (4 B), 40 + 46 = 86 (2 C)
+    info = BuildInfo({"A": [10.0, 1.0], "B": [20.0, 4.0], 
+                      "C": [40.0, 4.0]}, 1.15, ["A", "B", "C"])
+    suite.run_test(info.affordable_counts(100.0), [6, 4, 2], "Test #16:")
+    suite.run_test(info.affordable_counts(9.0), [0, 0, 0], "Test #17:")
+    suite.run_test(BuildInfo({"A": [10.0, 1.0], "B": [20.0, 4.0], 
+                              "C": [40.0, 4.0]}, 1.0, ["A", "B", "C"])
+                   .affordable_counts(100.0), [10, 5, 2], "Test #18:")
+    # Budgets on the edge of 13 and 2 copies, where the logarithm
+    # rounds to 12 and to 2 copies: the loops correct both
+    single = BuildInfo({"A": [1.0, 1.0]}, 1.15)
+    suite.run_test(single.affordable_counts(34.35191747529843), [13], 
+                   "Test #19:")
+    suite.run_test(single.affordable_counts(2.1499999999999995), [1], 
+                   "Test #20:")
+    
+    state = ClickerState()
+    state.wait(5.0)
+    suite.run_test(state.affordability(info, 10.0), 
+                   ([5.0, 15.0, 35.0], [1, 0, 0]), "Test #21:")
+    suite.run_test(state.affordability(info, 95.0), 
+                   ([5.0, 15.0, 35.0], [6, 4, 2]), "Test #22:")
+    
+    # Fast mode gives the same game as asking the strategy every time,
+    # also for strategies it cannot follow
+    def strategy_flip(dummy_cookies, cps, dummy_time_left, dummy_build_info):
+        """
+        Picks Grandma at one CPS and Cursor otherwise
+        """
+        if round(cps * 10) == 13:
+            return "Grandma"
+        return "Cursor"
+    
+    def play(strategy, growth, fast):
+        """
+        Final total cookies, CPS and history of a short game
+        """
+        state = simulate_clicker(clicker.BuildInfo(None, growth), 1e5, 
+                                 strategy, fast)
+        return state.get_total_cookies(), state.get_cps(), state.get_history()
+    
+    test = 23
+    for strategy in [strategy_cursor_broken, strategy_cheap, 
+                     strategy_expensive, strategy_best, strategy_flip]:
+        for growth in [1.15, 1.01]:
+            suite.run_test(play(strategy, growth, True), 
+                           play(strategy, growth, False), 
+                           "Test #" + str(test) + ":")
+            test += 1
+    
+    # History kept every 3rd purchase; the list from get_entries() is
+    # extended in place and ends with the latest purchase
+    history = ClickerHistory("every", 3)
+    for second in range(1, 9):
+        history.add(float(second), "A", 1.0, float(second * second))
+    entries = history.get_entries()
+    suite.run_test(list(entries), 
+                   [(1.0, "A", 1.0, 1.0), (4.0, "A", 1.0, 16.0), 
+                    (7.0, "A", 1.0, 49.0), (8.0, "A", 1.0, 64.0)], 
+                   "Test #" + str(test) + ":")
+    test += 1
+    history.add(9.0, "B", 2.0, 81.0)
+    history.add(10.0, "B", 2.0, 100.0)
+    suite.run_test(history.get_entries() is entries and entries[3:], 
+                   [(10.0, "B", 2.0, 100.0)], "Test #" + str(test) + ":")
+    test += 1
+    suite.run_test(history.plot_points(3), 
+                   [(1.0, 1.0), (4.0, 16.0), (10.0, 100.0)], 
+                   "Test #" + str(test) + ":")
+    test += 1
+    suite.run_test(len(history.plot_points()), 4, "Test #" + str(test) + ":")
+    test += 1
+    
+    # Downsampling keeps the ends and the peaks
+    points = [(0, 0), (1, 1), (2, 0), (3, 5), (4, 0), (5, 1), (6, 0)]
+    suite.run_test(downsample_lttb(points, 4), 
+                   [(0, 0), (2, 0), (3, 5), (6, 0)], 
+                   "Test #" + str(test) + ":")
+    test += 1
+    suite.run_test(downsample_lttb(points, 3), [(0, 0), (3, 5), (6, 0)], 
+                   "Test #" + str(test) + ":")
+    test += 1
+    suite.run_test([downsample_lttb(points, 7), downsample_lttb(points, 2)], 
+                   [points, points], "Test #" + str(test) + ":")
+    test += 1
+    
+    # The profiler counts every decision once and samples every 3rd
+    profiler = ClickerProfiler(sample_every = 3)
+    simulate_clicker(BuildInfo(None, 1.15), 1e6, strategy_best, 
+                     profiler = profiler)
+    report = profiler.report()
+    decisions = report["decisions"]
+    suite.run_test([report["phases"]["strategy"]["calls"], 
+                    sum(count for dummy_bound, count 
+                        in report["strategy_histogram"]),
+                    len(report["samples"])], 
+                   [decisions, decisions, decisions // 3], 
+                   "Test #" + str(test) + ":")
+    test += 1
+    
+    # In fast mode the runs of purchases are a phase of their own
+    profiler = ClickerProfiler()
+    simulate_clicker(BuildInfo(None, 1.15), 1e6, strategy_expensive, True, 
+                     profiler = profiler)
+    phases = profiler.report()["phases"]
+    suite.run_test(phases["buy_repeatedly"]["calls"] > 0, True, 
+                   "Test #" + str(test) + ":")
+    test += 1
+    
+    # A game interrupted after some checkpoints and resumed matches
+    # an uninterrupted one, history file included
+    class Interrupted(Exception):
+        """
+        Stands in for a crash
+        """
+        pass
+    
+    def interrupt_after(calls, strategy):
+        """
+        Strategy that raises Interrupted on its calls + 1st call
+        """
+        counter = [0]
+        def interrupting(cookies, cps, time_left, build_info):
+            """
+            Counts the calls
+            """
+            counter[0] += 1
+            if counter[0] > calls:
+                raise Interrupted()
+            return strategy(cookies, cps, time_left, build_info)
+        return interrupting
+    
+    def game(state, history_path):
+        """
+        Final state, history and history file of a game
+        """
+        state.get_history_store().close()
+        return (state.get_cookies(), state.get_total_cookies(), 
+                state.get_cps(), state.get_time(), state.get_history(),
+                list(read_history(history_path)))
+    
+    directory = tempfile.mkdtemp()
+    try:
+        checkpoint = os.path.join(directory, "game.ckpt")
+        for retention, fast, calls in [("full", False, 50), 
+                                       ("every", True, 120), 
+                                       ("log", False, 200)]:
+            whole = os.path.join(directory, "whole.hist")
+            resumed = os.path.join(directory, "resumed.hist")
+            expected = game(simulate_clicker(
+                BuildInfo(None, 1.05), SIM_TIME, strategy_best, fast,
+                ClickerHistory(retention, path = whole)), whole)
+            try:
+                simulate_clicker(BuildInfo(None, 1.05), SIM_TIME, 
+                                 interrupt_after(calls, strategy_best), fast, 
+                                 ClickerHistory(retention, path = resumed),
+                                 checkpoint, 0.0)
+            except Interrupted:
+                pass
+            suite.run_test(game(resume_simulation(checkpoint, strategy_best, 
+                                                  0.0), resumed), 
+                           expected, "Test #" + str(test) + ":")
+            test += 1
+    finally:
+        shutil.rmtree(directory)
+    
+    suite.report_results()
+
     
-run()
+if __name__ == "__main__":
+    run_test_suite()
+    run()
     
 
@@ -0,0 +1,326 @@
+"""
+Expectimax player for the 4x4 2048 game.
+
+Searches on the packed boards of bitboard_2048, so any game object
+with get_grid_height/get_grid_width/get_tile (TwentyFortyEight or
+BitboardTwentyFortyEight) can be played.
+"""
+
+import time
+import bitboard_2048
+import simpletest
+
+from bitboard_2048 import UP, DOWN, LEFT, RIGHT
+
+
+DIRECTIONS = [UP, DOWN, LEFT, RIGHT]
+
+# Spawn probabilities for the chance nodes:
+PROB_TWO = 0.9
+PROB_FOUR = 0.1
+
+# Chance nodes whose cumulative probability falls below this
+# threshold are not expanded any further:
+CPROB_THRESHOLD = 0.0001
+
+# Default thinking time per move (seconds):
+TIME_BUDGET = 0.1
+
+# Clear the transposition table once it holds this many boards:
+TABLE_LIMIT = 500000
+
+# Weights of the row heuristic:
+LOST_PENALTY = 200000.0
+MONOTONICITY_POWER = 4.0
+MONOTONICITY_WEIGHT = 47.0
+SUM_POWER = 3.5
+SUM_WEIGHT = 11.0
+MERGES_WEIGHT = 700.0
+EMPTY_WEIGHT = 270.0
+
+
+def _row_heuristic(exponents):
+    """
+    Scores a single row of exponents: rewards empty cells,
+    possible merges and monotonic rows, penalises large tiles.
+    """
+    empty = 0
+    merges = 0
+    previous = 0
+    counter = 0
+    total = 0.0
+    for exp in exponents:
+        total += exp ** SUM_POWER
+        if exp == 0:
+            empty += 1
+        else:
+            if previous == exp:
+                counter += 1
+            elif counter > 0:
+                merges += 1 + counter
+                counter = 0
+            previous = exp
+    if counter > 0:
+        merges += 1 + counter
+
+    mono_left = 0.0
+    mono_right = 0.0
+    for index in range(1, len(exponents)):
+        before = exponents[index - 1] ** MONOTONICITY_POWER
+        after = exponents[index] ** MONOTONICITY_POWER
+        if exponents[index - 1] > exponents[index]:
+            mono_left += before - after
+        else:
+            mono_right += after - before
+
+    return (LOST_PENALTY + EMPTY_WEIGHT * empty + MERGES_WEIGHT * merges
+            - MONOTONICITY_WEIGHT * min(mono_left, mono_right)
+            - SUM_WEIGHT * total)
+
+
+# Heuristic score of every possible 16-bit row:
+ROW_HEURISTIC = [_row_heuristic(bitboard_2048._unpack_row(row))
+                 for row in range(bitboard_2048.ROW_MASK + 1)]
+
+
+def evaluate(board):
+    """
+    Heuristic value of a packed board, summed over
+    its rows and its columns.
+    """
+    transposed = bitboard_2048.transpose(board)
+    value = 0.0
+    for row_index in range(bitboard_2048.GRID_SIZE):
+        shift = 16 * row_index
+        value += ROW_HEURISTIC[(board >> shift) & bitboard_2048.ROW_MASK]
+        value += ROW_HEURISTIC[(transposed >> shift)
+                               & bitboard_2048.ROW_MASK]
+    return value
+
+
+def search_depth(board):
+    """
+    Chooses the search depth from the number of empty cells:
+    crowded boards are searched deeper.
+    """
+    num_empty = len(bitboard_2048.empty_cells(board))
+    if num_empty >= 8:
+        return 2
+    elif num_empty >= 4:
+        return 3
+    return 4
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search once the deadline of a move has passed.
+    """
+    pass
+
+
+def pack_game(game):
+    """
+    Packs the tiles of a 4x4 game object into a 64-bit board.
+    """
+    board = 0
+    for row in range(bitboard_2048.GRID_SIZE):
+        for col in range(bitboard_2048.GRID_SIZE):
+            exponent = bitboard_2048.to_exponent(game.get_tile(row, col))
+            board |= exponent << (16 * row + 4 * col)
+    return board
+
+
+class ExpectimaxPlayer:
+    """
+    Expectimax search with a transposition table,
+    chance node pruning and iterative deepening.
+    """
+
+    def __init__(self, table_limit = TABLE_LIMIT):
+        self._table_limit = table_limit
+        self._table = {}
+        self._nodes = 0
+        self._table_hits = 0
+        self._moves = 0
+        self._search_time = 0.0
+
+
+    def _max_node(self, board, depth, cprob, deadline):
+        """
+        Value of the best move from a board that is waiting
+        for the player.
+        """
+        best = 0.0
+        for direction in DIRECTIONS:
+            new_board = bitboard_2048.execute_move(board, direction)[0]
+            if new_board != board:
+                best = max(best, self._chance_node(new_board, depth - 1,
+                                                   cprob, deadline))
+        return best
+
+
+    def _chance_node(self, board, depth, cprob, deadline):
+        """
+        Expected value of a board that is waiting for a
+        random tile to be spawned.  Raises SearchTimeout if
+        the deadline passes before the value is known.
+        """
+        self._nodes += 1
+        if depth <= 0 or cprob < CPROB_THRESHOLD:
+            return evaluate(board)
+        if time.time() >= deadline:
+            raise SearchTimeout()
+
+        entry = self._table.get(board)
+        if entry is not None and entry[0] >= depth:
+            self._table_hits += 1
+            return entry[1]
+
+        empties = bitboard_2048.empty_cells(board)
+        cprob /= len(empties)
+        total = 0.0
+        for index in empties:
+            shift = 4 * index
+            total += PROB_TWO * self._max_node(board | (1 << shift), depth,
+                                               cprob * PROB_TWO, deadline)
+            total += PROB_FOUR * self._max_node(board | (2 << shift), depth,
+                                                cprob * PROB_FOUR, deadline)
+        value = total / len(empties)
+
+        if len(self._table) >= self._table_limit:
+            self._table.clear()
+        self._table[board] = (depth, value)
+        return value
+
+
+    def choose(self, board, time_budget = TIME_BUDGET):
+        """
+        Returns the best direction for a packed board, or None
+        if no move changes the board.  Deepens the search one
+        level at a time until the adaptive depth is reached or
+        the time budget runs out, even in the middle of a depth.
+        """
+        start = time.time()
+        candidates = []
+        for direction in DIRECTIONS:
+            new_board = bitboard_2048.execute_move(board, direction)[0]
+            if new_board != board:
+                candidates.append((direction, new_board))
+        if not candidates:
+            return None
+
+        # Depth 1 only evaluates leaves and always completes; a deeper
+        # search that runs out of time is dropped and the move of the
+        # last completed depth is kept
+        deadline = start + time_budget
+        best_direction = candidates[0][0]
+        max_depth = search_depth(board)
+        depth = 1
+        try:
+            while depth <= max_depth:
+                best_value = -1.0
+                depth_best = best_direction
+                for direction, new_board in candidates:
+                    value = self._chance_node(new_board, depth - 1, 1.0,
+                                              deadline)
+                    if value > best_value:
+                        best_value = value
+                        depth_best = direction
+                best_direction = depth_best
+                depth += 1
+        except SearchTimeout:
+            pass
+
+        self._moves += 1
+        self._search_time += time.time() - start
+        return best_direction
+
+
+    def get_stats(self):
+        """
+        Returns a dictionary with the search counters and the
+        resulting moves per second and nodes per second.
+        """
+        stats = {"moves": self._moves,
+                 "nodes": self._nodes,
+                 "table_hits": self._table_hits,
+                 "table_size": len(self._table),
+                 "search_time": self._search_time,
+                 "moves_per_sec": 0.0,
+                 "nodes_per_sec": 0.0}
+        if self._search_time > 0:
+            stats["moves_per_sec"] = self._moves / self._search_time
+            stats["nodes_per_sec"] = self._nodes / self._search_time
+        return stats
+
+
+# Shared player used by best_move():
+PLAYER = ExpectimaxPlayer()
+
+def best_move(game, time_budget = TIME_BUDGET):
+    """
+    Returns the best direction for a 4x4 game object within
+    roughly time_budget seconds, or None if the game is over.
+    """
+    return PLAYER.choose(pack_game(game), time_budget)
+
+
+def play_game(game, time_budget = TIME_BUDGET):
+    """
+    Plays a whole game with the expectimax player and
+    prints the search statistics.  Returns the final score.
+    """
+    player = ExpectimaxPlayer()
+    score = 0
+    direction = player.choose(pack_game(game), time_budget)
+    while direction is not None:
+        score += game.move(direction).score
+        direction = player.choose(pack_game(game), time_budget)
+
+    stats = player.get_stats()
+    print "Score:", score, "Moves:", stats["moves"]
+    print "Moves/sec:", stats["moves_per_sec"], \
+          "Nodes/sec:", stats["nodes_per_sec"], \
+          "Table hits:", stats["table_hits"]
+    return score
+
+
+def run_test_suite():
+    """
+    Some informal tests
+    """
+    suite = simpletest.TestSuite()
+
+    game = bitboard_2048.BitboardTwentyFortyEight()
+    game.set_board(0)
+    suite.run_test(best_move(game), None, "Test #1:")
+
+    game.set_tile(0, 0, 2)
+    game.set_tile(0, 1, 2)
+    suite.run_test(best_move(game) in DIRECTIONS, True, "Test #2:")
+    suite.run_test(search_depth(game.get_board()), 2, "Test #3:")
+
+    player = ExpectimaxPlayer()
+    player.choose(game.get_board(), 0.0)
+    suite.run_test(player.get_stats()["moves"], 1, "Test #4:")
+    suite.run_test(player.get_stats()["nodes"] > 0, True, "Test #5:")
+
+    # A depth 4 search is cut short by the deadline:
+    crowded = [[2, 4, 8, 16], [32, 64, 128, 256],
+               [4, 8, 16, 32], [0, 2, 0, 0]]
+    for row in range(4):
+        for col in range(4):
+            game.set_tile(row, col, crowded[row][col])
+    suite.run_test(search_depth(game.get_board()), 4, "Test #6:")
+    player = ExpectimaxPlayer()
+    direction = player.choose(game.get_board(), 0.0)
+    suite.run_test(direction in game.legal_moves(), True, "Test #7:")
+    suite.run_test(player.get_stats()["nodes"], len(game.legal_moves()) + 1,
+                   "Test #8:")
+
+    suite.report_results()
+
+
+if __name__ == "__main__":
+    run_test_suite()
+    play_game(bitboard_2048.BitboardTwentyFortyEight())
@@ -0,0 +1,299 @@
+"""
+Streams 2048 self-play transitions into fixed-width binary shards.
+
+Every record holds (state, action, reward, next_state, done), with the
+states stored as one byte of tile exponent per cell.  A shard is a
+16-byte header followed by packed records, so a reader can map it with
+numpy.memmap and slice it without copying or parsing.  Each writer
+process owns its own shard files (the pid is part of the name), which
+lets several processes export into the same directory at once.
+"""
+
+import errno
+import multiprocessing
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import numpy as np
+import simpletest
+
+from game_2048 import twenty_forty_eight, UP, DOWN, LEFT, RIGHT, to_exponent
+
+MAGIC = b"2048SHD1"
+SHARD_HEADER = struct.Struct("<8sHHI")   # magic, height, width, reserved
+
+SHARD_BYTES = 64 * 1024 * 1024   # Rotate shards at this size
+BUFFER_RECORDS = 4096            # Records collected before each write
+
+
+def record_dtype(grid_height, grid_width):
+    """
+    Returns the numpy dtype of one transition record.
+    """
+    cells = grid_height * grid_width
+    return np.dtype([("state", np.uint8, (cells,)),
+                     ("action", np.uint8),
+                     ("reward", np.uint32),
+                     ("next_state", np.uint8, (cells,)),
+                     ("done", np.bool_)])
+
+
+def policy_random(game, rng):
+    """
+    Picks a random legal move.
+    """
+    return rng.choice(game.legal_moves())
+
+
+def policy_corner(game, dummy_rng):
+    """
+    Keeps the big tiles in the top left corner.
+    """
+    legal = game.legal_moves()
+    for direction in [LEFT, UP, RIGHT, DOWN]:
+        if direction in legal:
+            return direction
+
+
+POLICIES = {"random": policy_random,
+            "corner": policy_corner}
+
+
+# Tile value to exponent, filled in as new values show up:
+_EXPONENTS = {0: 0}
+
+def game_exponents(game):
+    """
+    Returns the flat list of tile exponents of a game.
+    """
+    exponents = []
+    for row in game.snapshot():
+        for value in row:
+            if value not in _EXPONENTS:
+                _EXPONENTS[value] = to_exponent(value)
+            exponents.append(_EXPONENTS[value])
+    return exponents
+
+
+class ShardWriter:
+    """
+    Buffers records and appends them to size-limited shard files
+    named <prefix>-<pid>-<number>.bin in the given directory.
+    """
+
+    def __init__(self, directory, grid_height, grid_width,
+                 prefix = "shard", shard_bytes = SHARD_BYTES):
+        self._directory = directory
+        self._prefix = prefix
+        self._header = SHARD_HEADER.pack(MAGIC, grid_height, grid_width, 0)
+        self._dtype = record_dtype(grid_height, grid_width)
+        self._shard_records = max(1, (shard_bytes - SHARD_HEADER.size)
+                                  // self._dtype.itemsize)
+        self._buffer = np.zeros(BUFFER_RECORDS, dtype = self._dtype)
+        self._buffered = 0
+        self._shard_number = 0
+        self._shard_file = None
+        self._shard_count = 0
+        self._paths = []
+
+
+    def get_paths(self):
+        """
+        Returns the paths of the shards written so far.
+        """
+        return list(self._paths)
+
+
+    def add(self, state, action, reward, next_state, done):
+        """
+        Adds one transition record.
+        """
+        index = self._buffered
+        self._buffer["state"][index] = state
+        self._buffer["action"][index] = action
+        self._buffer["reward"][index] = reward
+        self._buffer["next_state"][index] = next_state
+        self._buffer["done"][index] = done
+        self._buffered += 1
+        if self._buffered == BUFFER_RECORDS:
+            self.flush()
+
+
+    def _open_shard(self):
+        """
+        Starts the next shard file.
+        """
+        # Skip numbers already taken, e.g. by an earlier writer
+        # in the same process
+        while True:
+            name = "%s-%d-%05d.bin" % (self._prefix, os.getpid(),
+                                       self._shard_number)
+            path = os.path.join(self._directory, name)
+            self._shard_number += 1
+            try:
+                handle = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+                break
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+        self._shard_file = os.fdopen(handle, "wb")
+        self._shard_file.write(self._header)
+        self._shard_count = 0
+        self._paths.append(path)
+
+
+    def flush(self):
+        """
+        Writes the buffered records, rotating shards when full.
+        """
+        start = 0
+        while start < self._buffered:
+            if self._shard_file is None or \
+               self._shard_count == self._shard_records:
+                if self._shard_file is not None:
+                    self._shard_file.close()
+                self._open_shard()
+            count = min(self._buffered - start,
+                        self._shard_records - self._shard_count)
+            self._shard_file.write(
+                self._buffer[start:start + count].tobytes())
+            self._shard_count += count
+            start += count
+        self._buffered = 0
+        if self._shard_file is not None:
+            self._shard_file.flush()
+
+
+    def close(self):
+        """
+        Flushes the buffer and closes the current shard.
+        """
+        self.flush()
+        if self._shard_file is not None:
+            self._shard_file.close()
+            self._shard_file = None
+
+
+def open_shard(path):
+    """
+    Maps a shard read-only and returns it as a numpy record array;
+    slicing it reads straight from the file without copying.
+    """
+    with open(path, "rb") as shard_file:
+        magic, grid_height, grid_width, dummy_reserved = \
+            SHARD_HEADER.unpack(shard_file.read(SHARD_HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("not a 2048 shard: " + path)
+    dtype = record_dtype(grid_height, grid_width)
+    num_records = (os.path.getsize(path) - SHARD_HEADER.size) // dtype.itemsize
+    if num_records == 0:
+        return np.zeros(0, dtype = dtype)
+    return np.memmap(path, dtype = dtype, mode = "r",
+                     offset = SHARD_HEADER.size, shape = (num_records,))
+
+
+def export_games(directory, num_games, grid_height = 4, grid_width = 4,
+                 policy = "random", seed = None, prefix = "shard",
+                 shard_bytes = SHARD_BYTES):
+    """
+    Plays num_games games with the named policy and streams every
+    transition into shards.  Returns the list of shard paths.
+    """
+    rng = random.Random(seed)
+    choose = POLICIES[policy]
+    writer = ShardWriter(directory, grid_height, grid_width, prefix,
+                         shard_bytes)
+    for dummy_game in range(num_games):
+        game = twenty_forty_eight.TwentyFortyEight(
+            grid_height, grid_width, random.Random(rng.getrandbits(64)))
+        state = game_exponents(game)
+        while not game.is_game_over():
+            action = choose(game, rng)
+            result = game.move(action)
+            next_state = game_exponents(game)
+            writer.add(state, action, result.score, next_state,
+                       game.is_game_over())
+            state = next_state
+    writer.close()
+    return writer.get_paths()
+
+
+def _export_worker(args):
+    """
+    Pool entry point for export_parallel().
+    """
+    return export_games(*args)
+
+
+def export_parallel(directory, num_workers, games_per_worker,
+                    grid_height = 4, grid_width = 4, policy = "random",
+                    seed = 0, shard_bytes = SHARD_BYTES):
+    """
+    Runs export_games() in num_workers processes, each with its
+    own seed and shard files.  Returns all shard paths.
+    """
+    tasks = [(directory, games_per_worker, grid_height, grid_width,
+              policy, seed + worker, "shard", shard_bytes)
+             for worker in range(num_workers)]
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        paths = pool.map(_export_worker, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    return [path for worker_paths in paths for path in worker_paths]
+
+
+def run_test_suite():
+    """
+    Some informal tests
+    """
+    suite = simpletest.TestSuite()
+    directory = tempfile.mkdtemp()
+    try:
+        # Room for three 2x2 records per shard, so five records
+        # rotate into a second shard
+        dtype = record_dtype(2, 2)
+        writer = ShardWriter(directory, 2, 2, "test",
+                             SHARD_HEADER.size + 3 * dtype.itemsize)
+        for index in range(5):
+            writer.add([index, 0, 0, 1], UP, 4 * index, [0, 0, 1, index],
+                       index == 4)
+        writer.close()
+        paths = writer.get_paths()
+        suite.run_test(len(paths), 2, "Test #1:")
+        first = open_shard(paths[0])
+        second = open_shard(paths[1])
+        suite.run_test((len(first), len(second)), (3, 2), "Test #2:")
+        suite.run_test(first["reward"][1:3].tolist(), [4, 8], "Test #3:")
+        suite.run_test(second[1]["next_state"].tolist(), [0, 0, 1, 4],
+                       "Test #4:")
+        suite.run_test(second["done"].tolist(), [False, True], "Test #5:")
+
+        # Consecutive records of one game chain state to next_state
+        paths = export_games(directory, 1, 4, 4, "corner", 1, "game")
+        records = np.concatenate([open_shard(path) for path in paths])
+        suite.run_test(bool(records["done"][-1]), True, "Test #6:")
+        suite.run_test((records["state"][1:] ==
+                        records["next_state"][:-1]).all(), True, "Test #7:")
+    finally:
+        shutil.rmtree(directory)
+    suite.report_results()
+
+
+if __name__ == "__main__":
+    run_test_suite()
+    # Example export into the directory given on the command
+    # line, or a new temporary one
+    if len(sys.argv) > 1:
+        output_directory = sys.argv[1]
+    else:
+        output_directory = tempfile.mkdtemp(prefix = "export_2048_")
+    print "Writing shards to", output_directory
+    for shard_path in export_parallel(output_directory, 2, 10):
+        shard = open_shard(shard_path)
+        print shard_path, ":", len(shard), "records,", \
+              int(shard["reward"].sum()), "points"
@@ -0,0 +1,31 @@
+"""
+Names shared by the 2048 modules.
+
+The game lives in 2048.py, which cannot be imported with a plain
+import statement because its name starts with a digit, so it is
+loaded here once.  The direction constants and the conversion of
+tile values to exponents are taken from here as well.
+"""
+
+import importlib
+
+twenty_forty_eight = importlib.import_module("2048")
+
+# Directions for merging:
+UP = twenty_forty_eight.UP
+DOWN = twenty_forty_eight.DOWN
+LEFT = twenty_forty_eight.LEFT
+RIGHT = twenty_forty_eight.RIGHT
+
+DIRECTIONS = [UP, DOWN, LEFT, RIGHT]
+
+
+def to_exponent(value):
+    """
+    Converts a tile value (0, 2, 4, 8, ...) to its log2 exponent.
+    """
+    exponent = 0
+    while value > 1:
+        value >>= 1
+        exponent += 1
+    return exponent
@@ -5,12 +5,60 @@ Grid class
 EMPTY = 0
 FULL = 1
 
+# Neighbor tables shared by all grids of the same size:
+# (height, width) -> (cells, four way, eight way)
+_TABLES = {}
+
+
+def _neighbor_tables(grid_height, grid_width):
+    """
+    Returns the (row, col) of every cell index and the tuples of
+    four way and eight way neighbor indices of every cell, in the
+    order four_neighbors() and eight_neighbors() list them
+    """
+    key = (grid_height, grid_width)
+    if key not in _TABLES:
+        cells = []
+        four_way = []
+        eight_way = []
+        for row in range(grid_height):
+            for col in range(grid_width):
+                cells.append((row, col))
+                four = []
+                if row > 0:
+                    four.append((row - 1, col))
+                if row < grid_height - 1:
+                    four.append((row + 1, col))
+                if col > 0:
+                    four.append((row, col - 1))
+                if col < grid_width - 1:
+                    four.append((row, col + 1))
+                eight = list(four)
+                for drow, dcol in [(-1, -1), (-1, 1), (1, -1), (1, 1)]:
+                    if 0 <= row + drow < grid_height and \
+                       0 <= col + dcol < grid_width:
+                        eight.append((row + drow, col + dcol))
+                four_way.append(tuple(nrow * grid_width + ncol
+                                      for nrow, ncol in four))
+                eight_way.append(tuple(nrow * grid_width + ncol
+                                       for nrow, ncol in eight))
+        _TABLES[key] = (tuple(cells), tuple(four_way), tuple(eight_way))
+    return _TABLES[key]
+
+
 class Grid:
     """
     Implementation of 2D grid of cells
     Includes boundary handling
+
+    Cells are stored in one bytearray indexed by row * width + col;
+    the *_index methods work on those indices directly and the
+    neighbor indices of every cell are looked up in tables built
+    once per grid size.  The (row, col) methods index like the
+    nested lists the cells used to be: negative rows and columns
+    count from the end and anything past the end raises IndexError.
     """
-    
+
     def __init__(self, grid_height, grid_width):
         """
         Initializes grid to be empty, take height and width of grid as parameters
@@ -18,19 +66,34 @@ class Grid:
         """
         self._grid_height = grid_height
         self._grid_width = grid_width
-        self._cells = [[EMPTY for dummy_col in range(self._grid_width)] 
-                       for dummy_row in range(self._grid_height)]
-                
+        self._cells = bytearray(grid_height * grid_width)
+        self._cell_coords, self._four_table, self._eight_table = \
+            _neighbor_tables(grid_height, grid_width)
+
     def __str__(self):
         """
         Return multi-line string represenation for grid
         """
         ans = ""
         for row in range(self._grid_height):
-            ans += str(self._cells[row])
+            start = row * self._grid_width
+            ans += str(list(self._cells[start:start + self._grid_width]))
             ans += "\n"
         return ans
-    
+
+    def _index(self, row, col):
+        """
+        Return the flat index of (row, col), checking the column so
+        that it cannot run over into the next row (the row is checked
+        by the indexing itself)
+        """
+        width = self._grid_width
+        if col < 0:
+            col += width
+        if not 0 <= col < width:
+            raise IndexError("grid column out of range: " + str(col))
+        return row * width + col
+
     def get_grid_height(self):
         """
         Return the height of the grid for use in the GUI
@@ -48,70 +111,90 @@ class Grid:
         """
         Clears grid to be empty
         """
-        self._cells = [[EMPTY for dummy_col in range(self._grid_width)]
-                       for dummy_row in range(self._grid_height)]
-                
+        self._cells = bytearray(self._grid_height * self._grid_width)
+
     def set_empty(self, row, col):
         """
         Set cell with index (row, col) to be empty
         """
-        self._cells[row][col] = EMPTY
-    
+        self._cells[self._index(row, col)] = EMPTY
+
     def set_full(self, row, col):
         """
         Set cell with index (row, col) to be full
         """
-        self._cells[row][col] = FULL
-    
+        self._cells[self._index(row, col)] = FULL
+
     def is_empty(self, row, col):
         """
         Checks whether cell with index (row, col) is empty
         """
-        return self._cells[row][col] == EMPTY
- 
+        return self._cells[self._index(row, col)] == EMPTY
+
     def four_neighbors(self, row, col):
         """
         Returns horiz/vert neighbors of cell (row, col)
         """
-        ans = []
-        if row > 0:
-            ans.append((row - 1, col))
-        if row < self._grid_height - 1:
-            ans.append((row + 1, col))
-        if col > 0:
-            ans.append((row, col - 1))
-        if col < self._grid_width - 1:
-            ans.append((row, col + 1))
-        return ans
+        coords = self._cell_coords
+        return [coords[index] for index
+                in self._four_table[self._index(row, col)]]
 
     def eight_neighbors(self, row, col):
         """
         Returns horiz/vert neighbors of cell (row, col) as well as
         diagonal neighbors
         """
-        ans = []
-        if row > 0:
-            ans.append((row - 1, col))
-        if row < self._grid_height - 1:
-            ans.append((row + 1, col))
-        if col > 0:
-            ans.append((row, col - 1))
-        if col < self._grid_width - 1:
-            ans.append((row, col + 1))
-        if (row > 0) and (col > 0):
-            ans.append((row - 1, col - 1))
-        if (row > 0) and (col < self._grid_width - 1):
-            ans.append((row - 1, col + 1))
-        if (row < self._grid_height - 1) and (col > 0):
-            ans.append((row + 1, col - 1))
-        if (row < self._grid_height - 1) and (col < self._grid_width - 1):
-            ans.append((row + 1, col + 1))
-        return ans
-    
+        coords = self._cell_coords
+        return [coords[index] for index
+                in self._eight_table[self._index(row, col)]]
+
+    def get_cell_index(self, row, col):
+        """
+        Returns the flat index of cell (row, col)
+        """
+        return self._index(row, col)
+
+    def get_row_col(self, index):
+        """
+        Returns the (row, col) of the cell with the given flat index
+        """
+        return self._cell_coords[index]
+
+    def set_empty_index(self, index):
+        """
+        Set the cell with the given flat index to be empty
+        """
+        self._cells[index] = EMPTY
+
+    def set_full_index(self, index):
+        """
+        Set the cell with the given flat index to be full
+        """
+        self._cells[index] = FULL
+
+    def is_empty_index(self, index):
+        """
+        Checks whether the cell with the given flat index is empty
+        """
+        return self._cells[index] == EMPTY
+
+    def four_neighbor_indices(self, index):
+        """
+        Returns the tuple of flat indices of the horiz/vert
+        neighbors of a cell (shared, do not modify)
+        """
+        return self._four_table[index]
+
+    def eight_neighbor_indices(self, index):
+        """
+        Returns the tuple of flat indices of the horiz/vert and
+        diagonal neighbors of a cell (shared, do not modify)
+        """
+        return self._eight_table[index]
+
     def get_index(self, point, cell_size):
         """
         Takes point in screen coordinates and returns index of
         containing cell
         """
-        return (point[1] / cell_size, point[0] / cell_size) 
-
+        return (point[1] / cell_size, point[0] / cell_size)
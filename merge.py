@@ -2,6 +2,12 @@
 Merge function for 2048 game.
 """
 
+import collections
+
+
+# Default bound on the number of distinct lines kept in the cache:
+CACHE_SIZE = 4096
+
 def slide_list(line):
     """
     Slides all of the non-zero tiles slid over to the 
@@ -18,33 +24,115 @@ def slide_list(line):
             slided.append(0)
     return slided
 
+def merge_line(line):
+    """
+    Merges a single row or column in one pass.
+    Returns a tuple (merged tuple, points gained, changed flag).
+    """
+    merged = []
+    score = 0
+    pending = 0
+    for num in line:
+        if num == 0:
+            continue
+        if num == pending:
+            merged.append(num * 2)
+            score += num * 2
+            pending = 0
+        else:
+            if pending:
+                merged.append(pending)
+            pending = num
+    if pending:
+        merged.append(pending)
+    merged.extend([0] * (len(line) - len(merged)))
+    merged = tuple(merged)
+    return merged, score, merged != tuple(line)
+
+
+class MergeEngine:
+    """
+    Memoizes merge results per line in a bounded LRU cache.
+    Short lines can be served from a complete pregenerated
+    transition table instead.
+    """
+
+    def __init__(self, cache_size = CACHE_SIZE):
+        self._cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._table = {}
+        self._hits = 0
+        self._misses = 0
+
+    def pregenerate(self, length, max_exponent):
+        """
+        Fill the transition table with every line of the given
+        length whose tiles are at most 2 ** max_exponent.
+        The table holds (max_exponent + 1) ** length entries and
+        is never evicted.
+        """
+        values = [0] + [2 ** exp for exp in range(1, max_exponent + 1)]
+        lines = [()]
+        for dummy_i in range(length):
+            lines = [line + (value,) for line in lines for value in values]
+        for line in lines:
+            self._table[line] = merge_line(line)
+
+    def merge_line(self, line):
+        """
+        Cached version of merge_line().
+        Returns a tuple (merged tuple, points gained, changed flag).
+        """
+        key = tuple(line)
+        result = self._table.get(key)
+        if result is not None:
+            self._hits += 1
+            return result
+        result = self._cache.pop(key, None)
+        if result is not None:
+            self._hits += 1
+        else:
+            self._misses += 1
+            result = merge_line(key)
+            if len(self._cache) >= self._cache_size:
+                self._cache.popitem(last = False)
+        self._cache[key] = result
+        return result
+
+    def merge(self, line):
+        """
+        Drop-in replacement for merge() that returns a new list.
+        """
+        return list(self.merge_line(line)[0])
+
+    def get_stats(self):
+        """
+        Return a dictionary with the hit and miss counters and
+        the current sizes of the cache and the table.
+        """
+        return {"hits": self._hits,
+                "misses": self._misses,
+                "cache_size": len(self._cache),
+                "table_size": len(self._table)}
+
+    def clear(self):
+        """
+        Empty the cache and reset the counters.
+        The pregenerated table is kept.
+        """
+        self._cache.clear()
+        self._hits = 0
+        self._misses = 0
+
+
+# Shared engine used by merge():
+ENGINE = MergeEngine()
+
 def merge(line):
     """
     Function that merges a single row or column in 2048.
     """
-    result = []
-    slided = slide_list(line)
-    index  = 0
-    
-    while index <= len(slided) - 1:
-        if index == len(slided) - 1:
-            result.append(slided[index])
-            index += 1
-        elif slided[index] != slided[index + 1]:
-            if index == len(slided) - 2:
-                result.append(slided[index])
-                result.append(slided[index + 1])
-            else:
-                result.append(slided[index])
-            index += 1
-        else:
-            result += (([slided[index] * 2]) + [0])
-            index += 2
-    
-    if len(result) > len(slided):
-        return slide_list(result[:-1])
-    else:
-        return slide_list(result)
+    return ENGINE.merge(line)
     
 
 def run_tests():
@@ -54,9 +142,23 @@ def run_tests():
     assert merge([2, 2, 0, 0]) == [4, 0, 0, 0]
     assert merge([2, 2, 2, 2, 2]) == [4, 4, 2, 0, 0]
     assert merge([8, 16, 16, 8]) == [8, 32, 8, 0]
+    assert merge_line([2, 2, 4, 4]) == ((4, 8, 0, 0), 12, True)
+    assert merge_line([4, 2, 0, 0]) == ((4, 2, 0, 0), 0, False)
     
-    print "All tests pass!!!"
+    engine = MergeEngine(cache_size = 2)
+    engine.merge([2, 2, 0, 0])
+    engine.merge([2, 2, 0, 0])
+    engine.merge([4, 4, 0, 0])
+    engine.merge([8, 8, 0, 0])
+    assert engine.get_stats()["hits"] == 1
+    assert engine.get_stats()["cache_size"] == 2
     
-run_tests()
- 
+    engine.pregenerate(3, 2)
+    assert engine.get_stats()["table_size"] == 27
+    assert engine.merge_line([4, 4, 2]) == ((8, 2, 0), 8, True)
     
+    print "All tests pass!!!"
+    
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,304 @@
+"""
+Monte Carlo 2048 player running its rollouts on a process pool.
+
+Boards are sent to the workers as a (height, width, exponent string)
+tuple instead of pickled game objects, and every chunk of trials
+draws from its own seeded random stream so results do not depend
+on which worker picks up which chunk.
+"""
+
+import multiprocessing
+import random
+import time
+import merge as merge_cache
+import simpletest
+
+from game_2048 import UP, DOWN, LEFT, RIGHT, DIRECTIONS, to_exponent
+
+# Constants for Monte Carlo simulator:
+NTRIALS = 200       # Number of rollouts per direction
+CHUNK_TRIALS = 25   # Number of rollouts sent to a worker at once
+
+
+def pack_grid(game):
+    """
+    Serializes the tiles of a game object into a compact
+    (height, width, exponent string) tuple, one byte per tile.
+    """
+    height = game.get_grid_height()
+    width = game.get_grid_width()
+    exponents = bytearray(height * width)
+    for row in range(height):
+        for col in range(width):
+            exponents[row * width + col] = to_exponent(game.get_tile(row,
+                                                                     col))
+    return height, width, bytes(exponents)
+
+
+def unpack_grid(packed):
+    """
+    Returns the flat list of tile values of a packed grid.
+    """
+    exponents = bytearray(packed[2])
+    return [2 ** exponent if exponent else 0 for exponent in exponents]
+
+
+# Flat cell indices of every line, per grid size and direction:
+_LINES = {}
+
+def grid_lines(height, width):
+    """
+    Returns a dictionary mapping each direction to the lists of
+    flat cell indices of its lines, ordered in the direction the
+    tiles slide towards.
+    """
+    key = (height, width)
+    if key not in _LINES:
+        rows = [[row * width + col for col in range(width)]
+                for row in range(height)]
+        cols = [[row * width + col for row in range(height)]
+                for col in range(width)]
+        _LINES[key] = {UP: cols,
+                       DOWN: [line[::-1] for line in cols],
+                       LEFT: rows,
+                       RIGHT: [line[::-1] for line in rows]}
+    return _LINES[key]
+
+
+def move_cells(cells, lines):
+    """
+    Moves the tiles of a flat grid along the given lines in place.
+    Returns the points gained, or None if no tile moved.
+    """
+    score = 0
+    moved = False
+    for line in lines:
+        merged, points, changed = merge_cache.ENGINE.merge_line(
+            [cells[index] for index in line])
+        if changed:
+            moved = True
+            score += points
+            for index, value in zip(line, merged):
+                cells[index] = value
+    if moved:
+        return score
+    return None
+
+
+def spawn_tile(cells, rng):
+    """
+    Adds a 2 (90%) or a 4 (10%) to a random empty cell.
+    """
+    empties = [index for index, value in enumerate(cells) if value == 0]
+    if empties:
+        if rng.random() < 0.9:
+            cells[rng.choice(empties)] = 2
+        else:
+            cells[rng.choice(empties)] = 4
+
+
+def mc_trial(cells, lines, rng):
+    """
+    Plays random moves on a flat grid until no move is
+    possible and returns the points gained on the way.
+    """
+    score = 0
+    directions = list(DIRECTIONS)
+    while True:
+        rng.shuffle(directions)
+        for direction in directions:
+            points = move_cells(cells, lines[direction])
+            if points is not None:
+                score += points
+                spawn_tile(cells, rng)
+                break
+        else:
+            return score
+
+
+def run_trials(task):
+    """
+    Worker entry point.  Makes the first move in the given
+    direction, then plays num_trials rollouts from the result.
+    Returns (direction, number of trials, total score).
+    """
+    packed, direction, num_trials, seed = task
+    rng = random.Random(seed)
+    lines = grid_lines(packed[0], packed[1])
+    start_cells = unpack_grid(packed)
+    total = 0
+    for dummy_i in range(num_trials):
+        cells = list(start_cells)
+        points = move_cells(cells, lines[direction])
+        spawn_tile(cells, rng)
+        total += points + mc_trial(cells, lines, rng)
+    return direction, num_trials, total
+
+
+class MonteCarloPlayer:
+    """
+    Chooses moves by the best average rollout score,
+    spreading the rollouts over a pool of worker processes.
+    """
+
+    def __init__(self, trials = NTRIALS, processes = None, seed = None,
+                 chunk_trials = CHUNK_TRIALS):
+        self._trials = trials
+        self._chunk_trials = chunk_trials
+        self._processes = processes or multiprocessing.cpu_count()
+        self._pool = multiprocessing.Pool(self._processes)
+        self._seeds = random.Random(seed)
+        self._rollouts = 0
+        self._search_time = 0.0
+
+
+    def close(self):
+        """
+        Shut down the worker pool.
+        """
+        self._pool.close()
+        self._pool.join()
+
+
+    def choose(self, game, time_budget = None):
+        """
+        Returns the direction with the best average rollout score,
+        or None if no move changes the board.  Runs self._trials
+        rollouts per direction, or stops early after time_budget
+        seconds once every direction has been sampled.
+        """
+        start = time.time()
+        packed = pack_grid(game)
+        lines = grid_lines(packed[0], packed[1])
+        cells = unpack_grid(packed)
+        legal = [direction for direction in DIRECTIONS
+                 if move_cells(list(cells), lines[direction]) is not None]
+        if not legal:
+            return None
+
+        totals = dict((direction, 0) for direction in legal)
+        counts = dict((direction, 0) for direction in legal)
+        remaining = self._trials
+        num_chunks = max(1, self._processes // len(legal))
+        while remaining > 0:
+            # One round keeps every worker busy with a chunk; the last
+            # round splits what is left of the trials over the chunks
+            round_trials = min(self._chunk_trials * num_chunks, remaining)
+            chunk = -(-round_trials // num_chunks)
+            tasks = []
+            for offset in range(0, round_trials, chunk):
+                for direction in legal:
+                    tasks.append((packed, direction,
+                                  min(chunk, round_trials - offset),
+                                  self._seeds.getrandbits(32)))
+            for direction, num_trials, total in self._pool.map(run_trials,
+                                                               tasks):
+                totals[direction] += total
+                counts[direction] += num_trials
+            remaining -= round_trials
+            if time_budget is not None and time.time() - start >= time_budget:
+                break
+
+        self._rollouts += sum(counts.values())
+        self._search_time += time.time() - start
+        return max(legal, key = lambda direction:
+                   float(totals[direction]) / counts[direction])
+
+
+    def get_stats(self):
+        """
+        Returns a dictionary with the number of rollouts played
+        and the rollouts per second.
+        """
+        stats = {"rollouts": self._rollouts,
+                 "search_time": self._search_time,
+                 "rollouts_per_sec": 0.0}
+        if self._search_time > 0:
+            stats["rollouts_per_sec"] = self._rollouts / self._search_time
+        return stats
+
+
+def mc_move(game, trials = NTRIALS, time_budget = None, processes = None):
+    """
+    Returns a move for the game using a temporary worker pool.
+    """
+    player = MonteCarloPlayer(trials, processes)
+    try:
+        return player.choose(game, time_budget)
+    finally:
+        player.close()
+
+
+class _FixedGrid:
+    """
+    Minimal game object for the tests.
+    """
+    def __init__(self, rows):
+        self._rows = rows
+
+    def get_grid_height(self):
+        """
+        Returns the height of the grid.
+        """
+        return len(self._rows)
+
+    def get_grid_width(self):
+        """
+        Returns the width of the grid.
+        """
+        return len(self._rows[0])
+
+    def get_tile(self, row, col):
+        """
+        Returns the tile at row, col.
+        """
+        return self._rows[row][col]
+
+
+def run_test_suite():
+    """
+    Some informal tests
+    """
+    suite = simpletest.TestSuite()
+
+    game = _FixedGrid([[2, 4], [0, 0]])
+    packed = pack_grid(game)
+    suite.run_test(packed, (2, 2, "\x01\x02\x00\x00"), "Test #1:")
+    suite.run_test(unpack_grid(packed), [2, 4, 0, 0], "Test #2:")
+
+    cells = [2, 2, 0, 4]
+    suite.run_test(move_cells(cells, grid_lines(2, 2)[LEFT]), 4, "Test #3:")
+    suite.run_test(cells, [4, 0, 4, 0], "Test #4:")
+    suite.run_test(move_cells(cells, grid_lines(2, 2)[LEFT]), None,
+                   "Test #5:")
+
+    suite.run_test(run_trials((packed, DOWN, 10, 1)),
+                   run_trials((packed, DOWN, 10, 1)), "Test #6:")
+
+    player = MonteCarloPlayer(trials = 20, processes = 2, seed = 0)
+    suite.run_test(player.choose(_FixedGrid([[2, 4], [8, 16]])), None,
+                   "Test #7:")
+    suite.run_test(player.choose(game), DOWN, "Test #8:")
+    player.close()
+
+    # Exactly the given trials per direction, however they split
+    # over the chunks: 8 chunks for one move, 4 for two
+    player = MonteCarloPlayer(trials = 20, processes = 8, seed = 0)
+    player.choose(game)
+    suite.run_test(player.get_stats()["rollouts"], 20, "Test #9:")
+    player.close()
+    player = MonteCarloPlayer(trials = 30, processes = 8, seed = 0)
+    player.choose(_FixedGrid([[2, 0], [0, 0]]))
+    suite.run_test(player.get_stats()["rollouts"], 60, "Test #10:")
+    player.close()
+    player = MonteCarloPlayer(trials = 150, processes = 2, seed = 0,
+                              chunk_trials = 40)
+    player.choose(_FixedGrid([[2, 0], [0, 0]]))
+    suite.run_test(player.get_stats()["rollouts"], 300, "Test #11:")
+    player.close()
+
+    suite.report_results()
+
+
+if __name__ == "__main__":
+    run_test_suite()
@@ -0,0 +1,328 @@
+"""
+N-tuple network agent for the 4x4 2048 game.
+
+The value of a board is the sum of lookup-table weights, one table per
+tuple of cells, indexed by the tile exponents found in those cells on
+all 8 symmetries of the board.  The weights are learned by TD(0) on
+afterstates (the board right after a move, before the new tile) and
+live in flat array('f') tables that are checkpointed through mmap.
+"""
+
+import array
+import mmap
+import os
+import random
+import struct
+import tempfile
+import time
+import bitboard_2048
+import simpletest
+
+from bitboard_2048 import UP, DOWN, LEFT, RIGHT
+
+
+DIRECTIONS = [UP, DOWN, LEFT, RIGHT]
+
+# Tuples of cell indices (4 * row + col); every tuple has 4 cells,
+# so each table has 16 ** 4 entries:
+TUPLES = [(0, 1, 2, 3),
+          (4, 5, 6, 7),
+          (0, 1, 4, 5),
+          (1, 2, 5, 6),
+          (5, 6, 9, 10)]
+
+ALPHA = 0.1         # Learning rate, shared over all active weights
+
+# Checkpoint: header, the length of every tuple, the cells of all
+# tuples and then the weight tables
+CHECKPOINT_MAGIC = b"2048NTN1"
+CHECKPOINT_HEADER = struct.Struct("<8sII")   # magic, tuples, total cells
+
+
+def _reverse_row(row):
+    """
+    Returns a 16-bit row with its four nibbles in reverse order.
+    """
+    return ((row & 0xF) << 12 | (row & 0xF0) << 4 |
+            (row & 0xF00) >> 4 | (row & 0xF000) >> 12)
+
+
+# Mirror image of every possible 16-bit row:
+ROW_REVERSE = [_reverse_row(row) for row in range(bitboard_2048.ROW_MASK + 1)]
+
+
+def mirror(board):
+    """
+    Returns the board flipped left to right.
+    """
+    result = 0
+    for row_index in range(bitboard_2048.GRID_SIZE):
+        shift = 16 * row_index
+        result |= ROW_REVERSE[(board >> shift) & bitboard_2048.ROW_MASK] \
+            << shift
+    return result
+
+
+def flip(board):
+    """
+    Returns the board flipped top to bottom.
+    """
+    return ((board & 0xFFFF) << 48 | (board & 0xFFFF0000) << 16 |
+            (board >> 16) & 0xFFFF0000 | (board >> 48) & 0xFFFF)
+
+
+def symmetries(board):
+    """
+    Returns the 8 rotations and reflections of a board.
+    """
+    flipped = flip(board)
+    boards = [board, mirror(board), flipped, mirror(flipped)]
+    return boards + [bitboard_2048.transpose(each) for each in boards]
+
+
+class NTupleNetwork:
+    """
+    Lookup-table value function over n-tuples of cells.
+    """
+
+    def __init__(self, tuples = TUPLES):
+        self._tuples = [tuple(cells) for cells in tuples]
+        self._shifts = [[4 * cell for cell in cells] for cells in self._tuples]
+        self._tables = [array.array("f", [0.0]) * (16 ** len(cells))
+                        for cells in self._tuples]
+
+
+    def get_tuples(self):
+        """
+        Returns the list of tuples of the network.
+        """
+        return list(self._tuples)
+
+
+    def _indices(self, board):
+        """
+        Returns (table, index) for every weight that is active
+        on the board, over all of its symmetries.
+        """
+        indices = []
+        for each in symmetries(board):
+            for table, shifts in zip(self._tables, self._shifts):
+                index = 0
+                for position, shift in enumerate(shifts):
+                    index |= ((each >> shift) & 0xF) << (4 * position)
+                indices.append((table, index))
+        return indices
+
+
+    def value(self, board):
+        """
+        Returns the estimated value of a packed board.
+        """
+        total = 0.0
+        for table, index in self._indices(board):
+            total += table[index]
+        return total
+
+
+    def update(self, board, delta):
+        """
+        Adds delta, spread evenly over the active weights,
+        to the value of a packed board.
+        """
+        indices = self._indices(board)
+        step = delta / len(indices)
+        for table, index in indices:
+            table[index] += step
+
+
+    def save(self, path):
+        """
+        Writes the weight tables to a checkpoint file through mmap.
+        """
+        num_cells = sum(len(cells) for cells in self._tuples)
+        header = CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, len(self._tuples),
+                                        num_cells)
+        lengths = struct.pack("<%dB" % len(self._tuples),
+                              *[len(cells) for cells in self._tuples])
+        cells = struct.pack("<%dB" % num_cells,
+                            *[cell for cells in self._tuples
+                              for cell in cells])
+        tables = [table.tostring() for table in self._tables]
+        size = (len(header) + len(lengths) + len(cells)
+                + sum(len(data) for data in tables))
+        with open(path, "w+b") as checkpoint:
+            checkpoint.truncate(size)
+            mapped = mmap.mmap(checkpoint.fileno(), size)
+            offset = 0
+            for data in [header, lengths, cells] + tables:
+                mapped[offset:offset + len(data)] = data
+                offset += len(data)
+            mapped.flush()
+            mapped.close()
+
+
+def load_network(path):
+    """
+    Reads a checkpoint written by NTupleNetwork.save().
+    """
+    with open(path, "rb") as checkpoint:
+        mapped = mmap.mmap(checkpoint.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, num_tuples, num_cells = \
+            CHECKPOINT_HEADER.unpack(mapped[:CHECKPOINT_HEADER.size])
+        if magic != CHECKPOINT_MAGIC:
+            raise ValueError("not an n-tuple checkpoint: " + path)
+        offset = CHECKPOINT_HEADER.size
+        lengths = struct.unpack("<%dB" % num_tuples,
+                                mapped[offset:offset + num_tuples])
+        offset += num_tuples
+        if sum(lengths) != num_cells:
+            raise ValueError("corrupt n-tuple checkpoint: " + path)
+        cells = struct.unpack("<%dB" % num_cells,
+                              mapped[offset:offset + num_cells])
+        offset += num_cells
+        tuples = []
+        start = 0
+        for length in lengths:
+            tuples.append(cells[start:start + length])
+            start += length
+        network = NTupleNetwork(tuples)
+        for table in network._tables:
+            size = len(table) * table.itemsize
+            table[:] = array.array("f", mapped[offset:offset + size])
+            offset += size
+        mapped.close()
+    return network
+
+
+def best_action(network, board):
+    """
+    Returns (direction, afterstate, reward) of the move that
+    maximises reward + value(afterstate), or None if no move
+    changes the board.
+    """
+    best = None
+    best_value = None
+    for direction in DIRECTIONS:
+        afterstate, reward = bitboard_2048.execute_move(board, direction)
+        if afterstate == board:
+            continue
+        value = reward + network.value(afterstate)
+        if best is None or value > best_value:
+            best = (direction, afterstate, reward)
+            best_value = value
+    return best
+
+
+def spawn(board, rng):
+    """
+    Returns the board with a 2 (90%) or a 4 (10%) added
+    to a random empty cell.
+    """
+    index = rng.choice(bitboard_2048.empty_cells(board))
+    if rng.random() < 0.9:
+        return board | (1 << (4 * index))
+    return board | (2 << (4 * index))
+
+
+def train_episode(network, rng, alpha = ALPHA):
+    """
+    Plays one game with the greedy policy, updating the value
+    of each afterstate towards the reward and value of the next
+    afterstate.  Returns the score of the game.
+    """
+    board = spawn(spawn(0, rng), rng)
+    score = 0
+    previous = None
+    action = best_action(network, board)
+    while action is not None:
+        dummy_direction, afterstate, reward = action
+        score += reward
+        if previous is not None:
+            network.update(previous, alpha * (reward
+                                              + network.value(afterstate)
+                                              - network.value(previous)))
+        previous = afterstate
+        board = spawn(afterstate, rng)
+        action = best_action(network, board)
+    if previous is not None:
+        network.update(previous, -alpha * network.value(previous))
+    return score
+
+
+def train(network, episodes, seed = None, alpha = ALPHA, report_every = 100):
+    """
+    Runs TD(0) training for the given number of episodes and
+    prints the mean score and episodes per second every
+    report_every episodes.  Returns the list of scores.
+    """
+    rng = random.Random(seed)
+    scores = []
+    start = time.time()
+    for episode in range(1, episodes + 1):
+        scores.append(train_episode(network, rng, alpha))
+        if episode % report_every == 0:
+            elapsed = time.time() - start
+            recent = scores[-report_every:]
+            print "Episode", episode, "mean score:", \
+                  sum(recent) / len(recent), \
+                  "episodes/sec:", episode / elapsed
+    return scores
+
+
+def play_greedy(network, game):
+    """
+    Plays a BitboardTwentyFortyEight game to the end with the
+    greedy policy, without learning.  Returns the score.
+    """
+    score = 0
+    action = best_action(network, game.get_board())
+    while action is not None:
+        score += game.move(action[0]).score
+        action = best_action(network, game.get_board())
+    return score
+
+
+def run_test_suite():
+    """
+    Some informal tests
+    """
+    suite = simpletest.TestSuite()
+
+    board = 0x0000000000004321
+    suite.run_test(mirror(board), 0x0000000000001234, "Test #1:")
+    suite.run_test(flip(board), 0x4321000000000000, "Test #2:")
+    suite.run_test(len(set(symmetries(board))), 8, "Test #3:")
+
+    network = NTupleNetwork()
+    network.update(board, 80.0)
+    suite.run_test(network.value(board) > 0.0, True, "Test #4:")
+    suite.run_test(network.value(mirror(board)), network.value(board),
+                   "Test #5:")
+
+    train_episode(network, random.Random(1))
+    handle, path = tempfile.mkstemp(suffix = ".bin")
+    os.close(handle)
+    network.save(path)
+    loaded = load_network(path)
+    os.remove(path)
+    suite.run_test(loaded.get_tuples(), network.get_tuples(), "Test #6:")
+    suite.run_test(loaded.value(board), network.value(board), "Test #7:")
+
+    # Tuples of different lengths round-trip too
+    network = NTupleNetwork([(0, 1, 2), (4, 5, 6, 7), (8, 9)])
+    network.update(board, 30.0)
+    network.save(path)
+    loaded = load_network(path)
+    os.remove(path)
+    suite.run_test(loaded.get_tuples(), network.get_tuples(), "Test #8:")
+    suite.run_test(loaded.value(board), network.value(board), "Test #9:")
+
+    suite.report_results()
+
+
+if __name__ == "__main__":
+    run_test_suite()
+    NETWORK = NTupleNetwork()
+    train(NETWORK, 1000)
+    print "Greedy score:", \
+          play_greedy(NETWORK, bitboard_2048.BitboardTwentyFortyEight())
@@ -12,6 +12,15 @@ TILE_SIZE = 100
 HALF_TILE_SIZE = TILE_SIZE / 2
 BORDER_SIZE = 45
 
+# Largest tile exponent with a precomputed sprite offset
+MAX_EXPONENT = 17
+
+# Source center in the sprite sheet for each tile value
+SPRITE_CENTERS = dict((2 ** exponent, (HALF_TILE_SIZE + exponent * TILE_SIZE,
+                                        HALF_TILE_SIZE))
+                      for exponent in range(1, MAX_EXPONENT + 1))
+SPRITE_CENTERS[0] = (HALF_TILE_SIZE, HALF_TILE_SIZE)
+
 # Directions
 UP = 1
 DOWN = 2
@@ -35,6 +44,15 @@ class GUI:
         self._frame.set_canvas_background("#BCADA1")
         self._frame.start()
         self._game = game
+        # Canvas center of every cell, and the sprite center drawn
+        # there; rows are only recomputed when their tiles change
+        self._centers = [[(col * TILE_SIZE + HALF_TILE_SIZE + BORDER_SIZE,
+                           row * TILE_SIZE + HALF_TILE_SIZE + BORDER_SIZE)
+                          for col in range(self._cols)]
+                         for row in range(self._rows)]
+        self._sprites = [[SPRITE_CENTERS[0]] * self._cols
+                         for dummy_row in range(self._rows)]
+        self._drawn_rows = [None] * self._rows
         url = codeskulptor.file2url(IMAGENAME)
         self._tiles = simplegui.load_image(url)
         self._directions = {"up": UP, "down": DOWN,
@@ -50,23 +68,59 @@ class GUI:
                 self._game.move(dirval)
                 break
 
+    def game_rows(self):
+        """
+        Return the tiles of the game row by row, from its snapshot
+        if it has one and from get_tile otherwise
+        """
+        if hasattr(self._game, "snapshot"):
+            return self._game.snapshot()
+        return [tuple(self._game.get_tile(row, col)
+                      for col in range(self._cols))
+                for row in range(self._rows)]
+
+    def refresh(self):
+        """
+        Recompute the sprites of the rows that changed since the
+        last refresh.  Snapshots share unchanged rows, so a row
+        that is the same object as last time is skipped without
+        comparing its tiles.
+        """
+        rows = self.game_rows()
+        for row in range(self._rows):
+            tiles = rows[row]
+            drawn = self._drawn_rows[row]
+            if tiles is drawn or tiles == drawn:
+                continue
+            self._drawn_rows[row] = tiles
+            self._sprites[row] = [self.sprite_center(tile) for tile in tiles]
+
+    def sprite_center(self, tile):
+        """
+        Return the sprite sheet center for a tile value
+        """
+        if tile not in SPRITE_CENTERS:
+            val = int(math.log(tile, 2))
+            SPRITE_CENTERS[tile] = (HALF_TILE_SIZE + val * TILE_SIZE,
+                                    HALF_TILE_SIZE)
+        return SPRITE_CENTERS[tile]
+
     def draw(self, canvas):
         """
         Draw handler
         """
+        # The canvas is cleared before every frame, so all tiles are
+        # drawn, but from cached positions; the game may have changed
+        # outside the handlers (undo, a timed player), so its rows
+        # are checked every frame
+        self.refresh()
         for row in range(self._rows):
+            sprites = self._sprites[row]
+            centers = self._centers[row]
             for col in range(self._cols):
-                tile = self._game.get_tile(row, col)
-                if tile == 0:
-                    val = 0
-                else:
-                    val = int(math.log(tile, 2))
-                canvas.draw_image(self._tiles,
-                    [HALF_TILE_SIZE + val * TILE_SIZE, HALF_TILE_SIZE],
-                    [TILE_SIZE, TILE_SIZE],
-                    [col * TILE_SIZE + HALF_TILE_SIZE + BORDER_SIZE,
-                     row * TILE_SIZE + HALF_TILE_SIZE + BORDER_SIZE],
-                    [TILE_SIZE, TILE_SIZE])
+                canvas.draw_image(self._tiles, sprites[col],
+                                  [TILE_SIZE, TILE_SIZE], centers[col],
+                                  [TILE_SIZE, TILE_SIZE])
 
     def start(self):
         """
@@ -0,0 +1,170 @@
+"""
+Compact binary replay log for 2048 games.
+
+A replay file is a short header followed by one record per game.
+Each record stores the grid size, the seed of the game's random.Random
+and its moves at 2 bits per move; replaying the moves with the same
+seed reproduces every position of the game.
+
+Record layout (little-endian):
+    height (1 byte), width (1 byte), seed (8 bytes),
+    number of moves (4 bytes), moves packed 4 per byte
+"""
+
+import os
+import random
+import struct
+import tempfile
+import simpletest
+
+from game_2048 import twenty_forty_eight
+
+MAGIC = b"2048RPL1"
+RECORD_HEADER = struct.Struct("<BBQI")
+
+
+def pack_moves(moves):
+    """
+    Packs a list of directions (1 to 4) into a bytearray,
+    four moves per byte, first move in the lowest bits.
+    """
+    packed = bytearray((len(moves) + 3) // 4)
+    for index, direction in enumerate(moves):
+        packed[index // 4] |= (direction - 1) << (2 * (index % 4))
+    return packed
+
+
+def unpack_moves(packed, num_moves):
+    """
+    Inverse of pack_moves().
+    """
+    packed = bytearray(packed)
+    return [((packed[index // 4] >> (2 * (index % 4))) & 3) + 1
+            for index in range(num_moves)]
+
+
+class ReplayWriter:
+    """
+    Appends game records to a replay file.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._header = None
+        self._moves = []
+
+
+    def start_game(self, grid_height, grid_width, seed = None):
+        """
+        Starts recording a new game and returns a TwentyFortyEight
+        seeded to match the record.  A random seed is picked if
+        none is given.
+        """
+        if seed is None:
+            seed = random.getrandbits(64)
+        self._header = (grid_height, grid_width, seed)
+        self._moves = []
+        return twenty_forty_eight.TwentyFortyEight(grid_height, grid_width,
+                                                   random.Random(seed))
+
+
+    def record_move(self, direction):
+        """
+        Records one move of the current game.
+        """
+        self._moves.append(direction)
+
+
+    def end_game(self):
+        """
+        Writes the current game to the end of the file.
+        """
+        grid_height, grid_width, seed = self._header
+        self._file.write(RECORD_HEADER.pack(grid_height, grid_width, seed,
+                                            len(self._moves)))
+        self._file.write(pack_moves(self._moves))
+        self._file.flush()
+        self._header = None
+        self._moves = []
+
+
+    def close(self):
+        """
+        Closes the file; an unfinished game is discarded.
+        """
+        self._file.close()
+
+
+def read_games(path):
+    """
+    Generator that yields (height, width, seed, moves) for every
+    game in a replay file, reading one record at a time.
+    """
+    with open(path, "rb") as replay_file:
+        if replay_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("not a 2048 replay file: " + path)
+        while True:
+            header = replay_file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            grid_height, grid_width, seed, num_moves = \
+                RECORD_HEADER.unpack(header)
+            packed = replay_file.read((num_moves + 3) // 4)
+            yield grid_height, grid_width, seed, unpack_moves(packed,
+                                                              num_moves)
+
+
+def replay(record, num_moves = None):
+    """
+    Rebuilds the game of a record after its first num_moves moves
+    (all of them by default) and returns the TwentyFortyEight.
+    """
+    grid_height, grid_width, seed, moves = record
+    game = twenty_forty_eight.TwentyFortyEight(grid_height, grid_width,
+                                               random.Random(seed))
+    if num_moves is None:
+        num_moves = len(moves)
+    for direction in moves[:num_moves]:
+        game.move(direction)
+    return game
+
+
+def run_test_suite():
+    """
+    Some informal tests
+    """
+    suite = simpletest.TestSuite()
+
+    moves = [1, 2, 3, 4, 4, 3]
+    suite.run_test(len(pack_moves(moves)), 2, "Test #1:")
+    suite.run_test(unpack_moves(pack_moves(moves), 6), moves, "Test #2:")
+
+    handle, path = tempfile.mkstemp(suffix = ".bin")
+    os.close(handle)
+    writer = ReplayWriter(path)
+    game = writer.start_game(4, 4, seed = 12345)
+    positions = [str(game)]
+    for direction in [1, 3, 2, 4, 1, 3, 2, 4]:
+        game.move(direction)
+        writer.record_move(direction)
+        positions.append(str(game))
+    writer.end_game()
+    writer.start_game(5, 3, seed = 1)
+    writer.record_move(2)
+    writer.end_game()
+    writer.close()
+
+    records = list(read_games(path))
+    suite.run_test(len(records), 2, "Test #3:")
+    suite.run_test(str(replay(records[0])), positions[-1], "Test #4:")
+    suite.run_test(str(replay(records[0], 3)), positions[3], "Test #5:")
+    suite.run_test(records[1][:3], (5, 3, 1), "Test #6:")
+    os.remove(path)
+
+    suite.report_results()
+
+
+if __name__ == "__main__":
+    run_test_suite()
@@ -0,0 +1,238 @@
+"""
+Parallel tournament runner for the Cookie Clicker strategies.
+
+Runs every strategy on every combination of build configuration and
+growth factor in a process pool, and collects the final total cookies,
+number of purchases and wall time into one results table.  Finished
+cells are cached on disk as small JSON files keyed by strategy name,
+config hash and duration, so re-running a tournament only simulates
+the cells that are new.
+
+Usage: python tournament_clicker.py [--cache DIR] [--duration SECONDS]
+                                    [--processes N] [--fast]
+                                    [--output results.json]
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import clicker
+import cookie_clicker
+import simpletest
+
+
+STRATEGIES = {"Cursor": cookie_clicker.strategy_cursor_broken,
+              "Cheap": cookie_clicker.strategy_cheap,
+              "Expensive": cookie_clicker.strategy_expensive,
+              "Best": cookie_clicker.strategy_best}
+
+# Build configurations: name -> {item: [cost, cps]}
+CONFIGS = {"default": clicker.DEFAULT_BUILD_INFO,
+           "double cost": dict((item, [2 * cost, cps]) for item, (cost, cps)
+                               in clicker.DEFAULT_BUILD_INFO.items())}
+
+GROWTH_FACTORS = [1.1, clicker.BUILD_GROWTH, 1.2]
+
+CACHE_DIR = "tournament_cache"
+
+
+def config_hash(build_info, growth_factor):
+    """
+    Returns a short hash of a build configuration and growth factor.
+    """
+    key = json.dumps([sorted([item, list(value)] for item, value
+                             in build_info.items()), growth_factor])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def cache_path(cache_dir, strategy_name, cfg_hash, duration):
+    """
+    Returns the path of the cache file of one tournament cell.
+    """
+    name = "".join(char if char.isalnum() else "_" for char in strategy_name)
+    return os.path.join(cache_dir, "%s-%s-%r.json" % (name, cfg_hash,
+                                                      duration))
+
+
+def load_cell(path, strategy_name):
+    """
+    Returns the cached result row stored at path,
+    or None if there is no usable one.
+    """
+    try:
+        with open(path) as cache_file:
+            row = json.load(cache_file)
+    except (IOError, ValueError):
+        return None
+    if row.get("strategy") != strategy_name:
+        return None
+    return row
+
+
+def save_cell(path, row):
+    """
+    Writes a result row to the cache; the file is renamed into place
+    so that an interrupted run never leaves half a file behind.
+    """
+    handle, temp_path = tempfile.mkstemp(dir = os.path.dirname(path),
+                                         suffix = ".tmp")
+    with os.fdopen(handle, "w") as cache_file:
+        json.dump(row, cache_file, sort_keys = True)
+    os.rename(temp_path, path)
+
+
+def run_cell(task):
+    """
+    Pool entry point: simulates one strategy on one configuration
+    and returns its result row.
+    """
+    (strategy_name, strategy, config_name, build_info, growth_factor,
+     duration, fast) = task
+    start = time.time()
+    state = cookie_clicker.simulate_clicker(
+        clicker.BuildInfo(build_info, growth_factor), duration, strategy, fast)
+    elapsed = time.time() - start
+    return {"strategy": strategy_name,
+            "config": config_name,
+            "config_hash": config_hash(build_info, growth_factor),
+            "growth_factor": growth_factor,
+            "duration": duration,
+            "total_cookies": state.get_total_cookies(),
+            "purchases": state.get_history_store().get_count() - 1,
+            "cps": state.get_cps(),
+            "seconds": elapsed}
+
+
+def run_tournament(strategies = STRATEGIES, configs = CONFIGS,
+                   growth_factors = GROWTH_FACTORS,
+                   duration = cookie_clicker.SIM_TIME, cache_dir = CACHE_DIR,
+                   processes = None, fast = False):
+    """
+    Runs every strategy (name -> function) on every configuration
+    (name -> build info dictionary) and growth factor, skipping cells
+    found in the cache.  Returns the list of result rows sorted by
+    configuration, growth factor and strategy.
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    rows = []
+    tasks = []
+    for config_name in sorted(configs):
+        build_info = configs[config_name]
+        for growth_factor in growth_factors:
+            cfg_hash = config_hash(build_info, growth_factor)
+            for strategy_name in sorted(strategies):
+                path = cache_path(cache_dir, strategy_name, cfg_hash, duration)
+                row = load_cell(path, strategy_name)
+                if row is not None:
+                    row["config"] = config_name
+                    rows.append(row)
+                else:
+                    tasks.append((strategy_name, strategies[strategy_name],
+                                  config_name, build_info, growth_factor,
+                                  duration, fast))
+
+    if tasks:
+        pool = multiprocessing.Pool(processes)
+        try:
+            # Cache every cell as soon as it is done, so that an
+            # interrupted tournament keeps its finished cells
+            for row in pool.imap_unordered(run_cell, tasks):
+                save_cell(cache_path(cache_dir, row["strategy"],
+                                     row["config_hash"], duration), row)
+                rows.append(row)
+        finally:
+            pool.close()
+            pool.join()
+
+    rows.sort(key = lambda row: (row["config"], row["growth_factor"],
+                                 row["strategy"]))
+    return rows
+
+
+def print_table(rows):
+    """
+    Prints the result rows as a table.
+    """
+    print "%-12s %6s %-10s %14s %10s %9s" % ("Config", "Growth", "Strategy",
+                                             "Total cookies", "Purchases",
+                                             "Seconds")
+    for row in rows:
+        print "%-12s %6.3f %-10s %14.6g %10d %9.3f" % (
+            row["config"], row["growth_factor"], row["strategy"],
+            row["total_cookies"], row["purchases"], row["seconds"])
+
+
+def main():
+    """
+    Runs the tournament from the command line.
+    """
+    parser = argparse.ArgumentParser(description = "Cookie Clicker "
+                                     "strategy tournament")
+    parser.add_argument("--cache", default = CACHE_DIR,
+                        help = "directory of cached results")
+    parser.add_argument("--duration", type = float,
+                        default = cookie_clicker.SIM_TIME)
+    parser.add_argument("--processes", type = int,
+                        help = "worker processes (default: one per CPU)")
+    parser.add_argument("--fast", action = "store_true",
+                        help = "use the bulk-purchase fast path")
+    parser.add_argument("--output", help = "where to write the JSON results")
+    args = parser.parse_args()
+
+    rows = run_tournament(duration = args.duration, cache_dir = args.cache,
+                          processes = args.processes, fast = args.fast)
+    print_table(rows)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(rows, output, indent = 2, sort_keys = True)
+
+
+def run_test_suite():
+    """
+    Some informal tests
+    """
+    suite = simpletest.TestSuite()
+    default = CONFIGS["default"]
+    suite.run_test(config_hash(default, 1.1), config_hash(dict(default), 1.1),
+                   "Test #1:")
+    suite.run_test(config_hash(default, 1.1) == config_hash(default, 1.2),
+                   False, "Test #2:")
+    suite.run_test(os.path.basename(cache_path("dir", "Best ratio", "abc",
+                                               100.0)),
+                   "Best_ratio-abc-100.0.json", "Test #3:")
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(cache_dir, "cell.json")
+        save_cell(path, {"strategy": "Cheap", "total_cookies": 1.5})
+        suite.run_test(load_cell(path, "Cheap"),
+                       {"strategy": "Cheap", "total_cookies": 1.5}, "Test #4:")
+        suite.run_test(load_cell(path, "Best"), None, "Test #5:")
+        suite.run_test(load_cell(path + ".missing", "Cheap"), None,
+                       "Test #6:")
+
+        # A finished cell is read back from the cache on the next run
+        strategies = {"Cheap": cookie_clicker.strategy_cheap}
+        rows = run_tournament(strategies, {"default": default}, [1.15],
+                              1e4, cache_dir, 1)
+        state = cookie_clicker.simulate_clicker(clicker.BuildInfo(default),
+                                                1e4,
+                                                cookie_clicker.strategy_cheap)
+        suite.run_test([row["total_cookies"] for row in rows],
+                       [state.get_total_cookies()], "Test #7:")
+        suite.run_test(run_tournament(strategies, {"default": default},
+                                      [1.15], 1e4, cache_dir, 1),
+                       rows, "Test #8:")
+    finally:
+        shutil.rmtree(cache_dir)
+    suite.report_results()
+
+
+if __name__ == "__main__":
+    main()
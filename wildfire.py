@@ -67,12 +67,13 @@ class WildFire(grid.Grid):
         Updates both the cells and the fire_boundary
         """
         cell = self._fire_boundary.dequeue()
-        neighbors = self.four_neighbors(cell[0], cell[1])
-        #neighbors = self.eight_neighbors(cell[0], cell[1])
+        index = self.get_cell_index(cell[0], cell[1])
+        neighbors = self.four_neighbor_indices(index)
+        #neighbors = self.eight_neighbor_indices(index)
         for neighbor in neighbors:
-            if self.is_empty(neighbor[0], neighbor[1]):
-                self.set_full(neighbor[0], neighbor[1])
-                self._fire_boundary.enqueue(neighbor)
+            if self.is_empty_index(neighbor):
+                self.set_full_index(neighbor)
+                self._fire_boundary.enqueue(self.get_row_col(neighbor))
 
                 
 # Run gui to visualize wildfire:                
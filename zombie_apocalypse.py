@@ -4,7 +4,6 @@ Student portion of Zombie Apocalypse mini-project
 
 import random
 import grid
-import queue
 import zombie_gui
 
 # global constants
@@ -102,36 +101,35 @@ class Apocalypse(grid.Grid):
         Distance at member of entity_list is zero
         Shortest paths avoid obstacles and use four-way distances
         """
-        visited = grid.Grid(self.get_grid_height(), self.get_grid_width())
-        distance_field = [[(self.get_grid_height() * self.get_grid_width()) 
-                           for dummy_col in range(self.get_grid_width())] 
-                          for dummy_row in range(self.get_grid_height())]
-        
-        boundary = queue.Queue()
+        height = self.get_grid_height()
+        width = self.get_grid_width()
+        visited = grid.Grid(height, width)
+        distance = [height * width] * (height * width)
         
         if entity_type == HUMAN:
-            for human in self.humans():
-                boundary.enqueue(human)
+            entities = self.humans()
         else:
-            for zombie in self.zombies():
-                boundary.enqueue(zombie)
-        
-        for entity in boundary:
-            visited.set_full(entity[0], entity[1])
-            distance_field[entity[0]][entity[1]] = 0 
-        
-        # Breadth First Search:
-        while boundary:
-            curr_cell = boundary.dequeue() # tuple of the form (row, col)
-            neighbors = self.four_neighbors(curr_cell[0], curr_cell[1])
-            for nbr in neighbors:
-                if visited.is_empty(nbr[0], nbr[1]) and self.is_empty(nbr[0], nbr[1]):
-                    visited.set_full(nbr[0], nbr[1])
-                    boundary.enqueue(nbr)
-                    curr_dist = distance_field[nbr[0]][nbr[1]]
-                    distance_field[nbr[0]][nbr[1]] = min(curr_dist, \
-                        distance_field[curr_cell[0]][curr_cell[1]] + 1)
-        return distance_field
+            entities = self.zombies()
+        
+        # Breadth First Search over flat cell indices; every visited
+        # cell is appended once, so the list doubles as the queue
+        boundary = []
+        for entity in entities:
+            index = self.get_cell_index(entity[0], entity[1])
+            visited.set_full_index(index)
+            distance[index] = 0
+            boundary.append(index)
+        
+        for curr_index in boundary:
+            nbr_dist = distance[curr_index] + 1
+            for nbr in self.four_neighbor_indices(curr_index):
+                if visited.is_empty_index(nbr) and self.is_empty_index(nbr):
+                    visited.set_full_index(nbr)
+                    distance[nbr] = nbr_dist
+                    boundary.append(nbr)
+        
+        return [distance[row * width:(row + 1) * width]
+                for row in range(height)]
          
                 
                     